@@ -23,6 +23,7 @@ import dotenv
 import boto3
 
 import country_functions as cf
+cf.start_run_report(os.path.join('..', 'data', 'run-reports', '1-pull-charts.json')) # stage timings / io written at exit, only with COUNTRY_RUN_REPORT=1 set
 
 # set working directory to location of .env file 
 env_path = '..' # change this location to run on your own directory
@@ -74,13 +75,19 @@ temp_folder = '..\\data\\temp'
 aws_folder = 'data/charts' # change if pop
 url = 'https://www.billboard.com/charts/country-songs/' # change if pulling pop charts
 
+# scraping params
+max_workers = 8 # concurrent page pulls
+requests_per_second = 2 # cap across all workers, be polite to billboard
+fixture_folder = None # set to a folder to save pulled pages as html fixtures
+offline = False # set to True to replay pages from fixture_folder instead of billboard (benchmarking)
+
 # check to see which charts still need to be pulled (allows for charts to be pulled in multiple steps)
 chart_files_raw = cf.list_files(s3, bucket, 'data/charts')
 pulled_charts = [file.split('/')[-1].replace('CHARTS_', '').replace('.csv', '') for file in chart_files_raw if 'CHARTS_' in file]
 charts_to_pull = [chart for chart in chart_dates if str(chart) not in pulled_charts]
 
-# loop through unpulled dates and save charts to s3
-for cd in charts_to_pull:
-    charts = cf.pull_charts(url, cd)
+# pull unpulled dates concurrently and save charts to s3 as they arrive
+for cd, charts in cf.pull_charts_concurrent(url, charts_to_pull, max_workers=max_workers, requests_per_second=requests_per_second,
+                                            fixture_folder=fixture_folder, offline=offline):
     filename = f'CHARTS_{str(cd)}.csv'
     cf.csv_to_s3(charts, filename, aws_client, bucket, temp_folder, aws_folder)
\ No newline at end of file
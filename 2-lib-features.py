@@ -25,6 +25,7 @@ import dotenv
 import boto3
 
 import country_functions as cf
+cf.start_run_report(os.path.join('..', 'data', 'run-reports', '2-lib-features.json')) # stage timings / io written at exit, only with COUNTRY_RUN_REPORT=1 set
 
 # set working directory to location of .env file 
 env_path = '..' # change this location to run on your own directory
@@ -51,6 +52,7 @@ s3 = boto3.client(
 bucket='country-bucket-guler'
 temp_folder = '..\\data\\temp'
 aws_folder = 'data'
+store = cf.open_storage(s3, bucket) # local read-through cache, files re-downloaded only when changed on s3
 
 ##########
 # STEP 1 - AGGREGATE CHARTS AND SAVE TO AWS
@@ -59,19 +61,23 @@ aws_folder = 'data'
 # list of chart files
 pulled_charts = [file for file in cf.list_files(s3, bucket, 'data/charts') if 'CHARTS' in file] # change if pop
 
-# create df of all charts
-charts = pd.DataFrame()
+# previously aggregated charts (incremental runs only read weeks missing from it)
+try:
+    existing_charts = cf.csv_from_s3('CHARTS.csv', s3, bucket, aws_folder, backend=store, index_col=0) # change if pop
+except s3.exceptions.NoSuchKey:
+    existing_charts = None
 
-for chart in pulled_charts:
-    that_week = pd.read_csv(s3.get_object(Bucket=bucket, Key=chart)['Body'])
-    charts = pd.concat((charts, that_week), axis=0)
-    
-charts = charts.iloc[:, 1:] # remove index column
-charts.rename(columns={'song' : 'title'}, inplace=True) # change column name
+# read new weeks concurrently and concatenate once, title lowercased and columns typed
+charts = cf.read_charts(pulled_charts, s3, bucket, existing=existing_charts, backend=store)
 
-# clean up formatting to enable aggregation by artist and successful lyric pulling
-charts.title = charts.title.str.lower()
-charts['artist_strip'] = charts.artist.apply(lambda x : x.lower().split(' x ')[0].split('featuring')[0].split( ' duet ')[0].split(' with ')[0].strip())
+# clean up formatting to enable aggregation by artist and successful lyric pulling (only rows added this run)
+# each distinct raw artist is normalized once, ever - the alias table persists raw artist -> artist_strip across runs
+artist_aliases = cf.ArtistAliases.load(store, 'data/ARTIST-ALIASES.csv') # change if pop
+if 'artist_strip' not in charts:
+    charts['artist_strip'] = pd.Series(None, index=charts.index, dtype=object) # object, so the strings below fit
+to_strip = charts.artist_strip.isna()
+charts.loc[to_strip, 'artist_strip'] = artist_aliases.normalize(charts.loc[to_strip, 'artist'])
+artist_aliases.save(store, 'data/ARTIST-ALIASES.csv') # change if pop
 
 # save back to AWS
 cf.csv_to_s3(charts, 'CHARTS.csv', s3, bucket, temp_folder, aws_folder) # change if pop
@@ -80,29 +86,22 @@ cf.csv_to_s3(charts, 'CHARTS.csv', s3, bucket, temp_folder, aws_folder) # change
 # STEP 2 - AGGREGATE UNIQUE SONGS
 ##########
 
-unique_songs = charts[['title', 'artist_strip']].drop_duplicates()
+unique_songs = charts[['title', 'artist_strip']].astype(object).drop_duplicates()
 unique_songs.artist_strip = unique_songs.artist_strip.str.replace('\n', '')
 unique_songs = unique_songs.query("artist_strip!='new' & artist_strip!='re-entry'").reset_index(drop=True) # artist sometimes listed as "new" or "re-entry"
-unique_songs['song_id'] = unique_songs.title + '-' + unique_songs.artist_strip
+unique_songs['song_id'] = cf.song_id(unique_songs.title, unique_songs.artist_strip)
 LIB = unique_songs.set_index(['song_id']) # create song_id
 
 ##########
 # STEP 3 - GET SONG METADATA
 ##########
 
-# MIN/MAX DATES
-min_max_dates = charts.groupby(['title', 'artist_strip']).date.agg(['min', 'max']).reset_index()
-min_max_dates = min_max_dates.query("artist_strip!='new' & artist_strip!='re-entry'")
-LIB = LIB.merge(min_max_dates, on=['title', 'artist_strip'], how='left', validate='one_to_one')
-
-# HIGHEST RANK
-highest_rank = charts.groupby(['title', 'artist_strip'])['rank'].min().to_frame('min_rank').reset_index()
-highest_rank = highest_rank.query("artist_strip!='new' & artist_strip!='re-entry'")
-LIB = LIB.merge(highest_rank, on=['title', 'artist_strip'], how='left', validate='one_to_one')
-
-# YEAR AND DECADE
-LIB['year'] = LIB['min'].apply(lambda x : int(x[:4]))
-LIB['decade'] = LIB['year'].apply(lambda x : int(np.floor(x/10)*10))
+# first/last week, peak rank, weeks on chart, year and decade per song, kept up to date incrementally
+# (only chart weeks not yet folded into the saved state are aggregated) - change folder if pop
+song_stats = cf.SongStats.load(store, 'data/song-stats')
+song_stats.update(charts)
+song_stats.save(store, 'data/song-stats')
+LIB = LIB.merge(song_stats.table(), on=['title', 'artist_strip'], how='left', validate='one_to_one')
 
 # GENDER FOR TOP ARTISTS (REQUIRES MANUAL TAGGING)
 
@@ -112,18 +111,17 @@ top_artist_decade = LIB.groupby(['decade', 'artist_strip']).title.count().to_fra
 cf.csv_to_s3(top_artist_decade, 'top_artists_decade.csv', s3, bucket, temp_folder, aws_folder)
 
 # re-upload tagged results and clean inconsistenciea
-artist_genders = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/gendered_country_band.csv')['Body'])
+artist_genders = cf.csv_from_s3('gendered_country_band.csv', s3, bucket, aws_folder, backend=store)
 artist_genders.artist_strip = artist_genders.artist_strip.str.strip()
 
-artist_genders[artist_genders.artist_strip == 'rascal flatts'] = 'm'
-artist_genders[artist_genders.artist_strip == 'gloriana'] = 'f'
-artist_genders[artist_genders.artist_strip == 'highway 101'] = 'f'
-artist_genders[artist_genders.artist_strip == 'robin lee'] = 'f'
-artist_genders[artist_genders.artist_strip == 'the kendalls'] = 'd'
+# manual corrections (only the gender column - assigning to whole rows also overwrote artist_strip)
+gender_fixes = {'rascal flatts' : 'm', 'gloriana' : 'f', 'highway 101' : 'f', 'robin lee' : 'f', 'the kendalls' : 'd'}
+fixed = artist_genders.artist_strip.isin(gender_fixes.keys())
+artist_genders.loc[fixed, 'gender'] = artist_genders.loc[fixed, 'artist_strip'].map(gender_fixes)
 
 # add back to LIB table and save to S3
 LIB = LIB.merge(artist_genders[['artist_strip', 'gender']].drop_duplicates(), how='left', on='artist_strip', validate='many_to_one')
-LIB['song_id'] = LIB.title + '-' + LIB.artist_strip
+LIB['song_id'] = cf.song_id(LIB.title, LIB.artist_strip)
 LIB = LIB.set_index(['song_id'])
 cf.csv_to_s3(LIB, 'LIB.csv', s3, bucket, temp_folder, aws_folder) # change if pop
 
@@ -131,6 +129,5 @@ cf.csv_to_s3(LIB, 'LIB.csv', s3, bucket, temp_folder, aws_folder) # change if po
 # STEP 4 - GET SEQUENTIAL LIST OF #1 SONGS
 ##########
 
-num_ones = charts.query('rank==1')
-TOP_SONGS_ORDER = num_ones[num_ones.title != num_ones.shift(1).title].reset_index(drop=True)
+TOP_SONGS_ORDER = song_stats.top_songs_order() # weekly #1s kept by the song statistics, consecutive repeats collapsed
 cf.csv_to_s3(TOP_SONGS_ORDER, 'TOP_SONGS_ORDER.csv', s3, bucket, temp_folder, aws_folder) # CHANGE IF POP
\ No newline at end of file
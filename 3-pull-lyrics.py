@@ -27,6 +27,7 @@ import lyricsgenius
 import regex as re
 import pickle
 import country_functions as cf
+cf.start_run_report(os.path.join('..', 'data', 'run-reports', '3-pull-lyrics.json')) # stage timings / io written at exit, only with COUNTRY_RUN_REPORT=1 set
 
 # set working directory to location of .env file
 env_path = '..'
@@ -38,7 +39,7 @@ dotenv.load_dotenv()
 genius_client_id=os.getenv('genius_client_id')
 genius_secret=os.getenv('genius_secret')
 genius_access_token=os.getenv('genius_access_token')
-genius = lyricsgenius.Genius(genius_access_token)
+genius = lyricsgenius.Genius(genius_access_token, timeout=15, retries=0) # per-request timeout, retries handled by cf.get_lyrics_concurrent
 genius.verbose = False # Turn off status messages
 access_key_id=os.getenv('s3_guler_key')
 access_key_secret=os.getenv('s3_guler_id')
@@ -58,39 +59,49 @@ s3 = boto3.client(
 bucket='country-bucket-guler'
 temp_folder = '..\\data\\temp'
 aws_folder = 'data'
+store = cf.open_storage(s3, bucket) # local read-through cache, files re-downloaded only when changed on s3
 
 ##########
 # STEP 1 - DETERMINE SONGS TO ADD
 ##########
 
-LIB = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/LIB.csv')['Body']).set_index('song_id') # song meta table, change key for pop
+LIB = cf.csv_from_s3('LIB.csv', s3, bucket, aws_folder, backend=store).set_index('song_id') # song meta table, change key for pop
 songs_to_add = list(LIB.index)
 
-all_lyrics = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/LYRICS.csv')['Body']).set_index('song_id') # lyrics pulled so far (ignore if process not yet started) - change key for pop
-added_songs = list(all_lyrics.index)
+# lyrics pulled so far live in an append-only shard store, only its manifest is read to resume - change prefix for pop
+lyrics_store = cf.LyricsStore(s3, bucket, 'data/lyrics-shards')
+
+# first run on the store - seed it with the lyrics table pulled by the old full-rewrite process, if any
+if not lyrics_store.manifest['shards'] and lyrics_store.backend.exists('data/LYRICS.csv'): # change key if pop
+    lyrics_store.commit(cf.csv_from_s3('LYRICS.csv', s3, bucket, aws_folder, backend=store).set_index('song_id'))
+
+added_songs = lyrics_store.song_ids
+batch_size = 50 # songs per committed shard
+
+# genius results cache shared with the pop variant and reruns, so no search is ever repeated
+lyrics_cache = cf.LyricsCache(os.path.join('..', 'data', 'genius-cache.jsonl'))
 
 ##########
 # STEP 2 - ADD SONGS
 ##########
 
-while set(added_songs) != set(songs_to_add): # use while loop due to timeout errors
-    try:
-        # get current state of lyrics to see which songs have already been pulled
-        all_lyrics = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/LYRICS.csv')['Body']).set_index('song_id') # change key if pop
-        added_songs = list(all_lyrics.index)
-        
-        # add remaining songs and save to s3 bucket
-        for song in set(songs_to_add).difference(added_songs):
-            title = LIB.loc[song].title
-            artist = LIB.loc[song].artist_strip
-
-            lyrics = cf.get_lyrics(title, artist, genius)
-
-            song_df = pd.DataFrame({'lyrics' : lyrics}, index=[song])
-            song_df.index.name = 'song_id'
-
-            all_lyrics = pd.concat((all_lyrics, song_df), axis=0)
-            cf.csv_to_s3(all_lyrics, 'POP-LYRICS.csv', s3, bucket, temp_folder, aws_folder)
-            
-    except:
-        pass
\ No newline at end of file
+song_meta = dict(zip(LIB.index, zip(LIB.title, LIB.artist_strip))) # song_id -> (title, artist_strip), dict hits instead of LIB.loc
+songs = [(song, *song_meta[song]) for song in set(songs_to_add).difference(added_songs)]
+
+# pull remaining songs concurrently, committing a shard every batch_size songs
+batch = {}
+for song, lyrics in cf.get_lyrics_concurrent(songs, genius, cache=lyrics_cache):
+    if lyrics is None: # failed after all retries, picked up again on the next run
+        continue
+    batch[song] = lyrics
+    if len(batch) >= batch_size:
+        lyrics_store.commit(pd.DataFrame({'lyrics' : batch}).rename_axis('song_id'))
+        batch = {}
+
+lyrics_store.commit(pd.DataFrame({'lyrics' : batch}).rename_axis('song_id'))
+
+##########
+# STEP 3 - COMPACT SHARDS INTO ONE LYRICS TABLE
+##########
+
+lyrics_store.compact('LYRICS.csv', aws_folder) # change if pop
@@ -22,7 +22,9 @@ from datetime import date, timedelta
 import dotenv
 import boto3
 import country_functions as cf
+cf.start_run_report(os.path.join('..', 'data', 'run-reports', '4-create-prune-content-tables.json')) # stage timings / io written at exit, only with COUNTRY_RUN_REPORT=1 set
 import nltk
+from string import punctuation
 
 # set working directory to location of .env file
 env_path = '..'
@@ -50,6 +52,7 @@ s3 = boto3.client(
 bucket='country-bucket-guler'
 temp_folder = '..\\data\\temp'
 aws_folder = 'data'
+store = cf.open_storage(s3, bucket) # local read-through cache, files re-downloaded only when changed on s3
 
 ##########
 # STEP 1 - MERGE LIB AND LYRICS TO GET CORPUS WITH OHCO
@@ -57,12 +60,12 @@ aws_folder = 'data'
 
 # pull in CORPUS and LIB
 
-CORPUS = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/LYRICS.csv')['Body'])
+CORPUS = cf.csv_from_s3('LYRICS.csv', s3, bucket, aws_folder, backend=store)
 CORPUS = CORPUS.query("lyrics!='song not found'") # remove songs where lyrics not found
 CORPUS.lyrics = CORPUS.lyrics.astype(str)
 CORPUS = CORPUS.set_index('song_id')
 
-LIB = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/LIB.csv')['Body'])
+LIB = cf.csv_from_s3('LIB.csv', s3, bucket, aws_folder, backend=store)
 LIB = LIB.set_index('song_id')
 
 # merge, set OHCO, save to S3
@@ -79,15 +82,15 @@ cf.csv_to_s3(CORPUS, 'CORPUS.csv', s3, bucket, temp_folder, aws_folder)
 ##########
 
 OHCO = ['decade', 'year', 'gender', 'artist_strip', 'title', 'section', 'line', 'token']
-CORPUS = pd.read_csv(s3.get_object(Bucket=bucket, Key='data/CORPUS.csv')['Body'])
+CORPUS = cf.csv_from_s3('CORPUS.csv', s3, bucket, aws_folder, backend=store)
 CORPUS.lyrics = CORPUS.lyrics.astype(str)
 CORPUS = CORPUS.set_index(OHCO[:5])
 
 # pre-process by removing punctuation, converting to lower, creating tokens for end line, section, song
-CORPUS['prepped'] = CORPUS.lyrics.map(lambda x: cf.prep_for_analysis(x, punctuation))
+CORPUS['prepped'] = cf.prep_corpus(CORPUS.lyrics, punctuation)
 
 # only use songs less than 1000 words (the rest are likely mispulls)
-CORPUS_REDUCED = CORPUS[CORPUS.lyrics.apply(lambda x : len(x.split(' '))) < 1000]
+CORPUS_REDUCED = CORPUS[cf.word_counts(CORPUS.lyrics) < 1000]
 
 # save to S3
 cf.csv_to_s3(CORPUS_REDUCED, 'CORPUS-REDUCED.csv', s3, bucket, temp_folder, aws_folder)
@@ -96,48 +99,21 @@ cf.csv_to_s3(CORPUS_REDUCED, 'CORPUS-REDUCED.csv', s3, bucket, temp_folder, aws_
 # STEP 3 - COLLAPSE OHCO AND SAVE TO S3
 ##########
 
-corpus2line_params = {
+# one pass over the corpus: each chunk of songs is split into sections, lines and tokens and streamed to all three tables
+collapse_params = {
     'aws_client' : s3,
     'input_file' : 'data/CORPUS-REDUCED.csv',
     'output_folder' : 'data',
-    'temp_folder' : '..\\data\\temp',
     'aws_bucket' : 'country-bucket-guler',
-    'output_name' : 'SECTION-REDUCED.csv',
+    'output_names' : ['SECTION-REDUCED', 'LINE-REDUCED', 'TOKEN-REDCUED'], # parquet datasets, read with cf.table_from_s3
     'OHCO' : ['decade', 'year', 'gender', 'artist_strip', 'title', 'section', 'line', 'token'],
     'level' : 6,
-    'splitter' : '<s>',
+    'splitters' : ['<s>', '<l>', ' '],
     'col_name_initial' : 'prepped',
-    'col_name_new' : 'section_lyrics'
+    'col_names_new' : ['section_lyrics', 'line_lyrics', 'TOKEN'],
+    'chunk_rows' : 2000,
+    'table_format' : 'parquet', # decade-partitioned, dictionary-encoded columns instead of csv
+    'backend' : store # reads go through the local cache
 } 
 
-sec2line_params = {
-    'aws_client' : s3,
-    'input_file' : 'data/SECTION-REDUCED.csv',
-    'output_folder' : 'data',
-    'temp_folder' : '..\\data\\temp',
-    'aws_bucket' : 'country-bucket-guler',
-    'output_name' : 'LINE-REDUCED.csv',
-    'OHCO' : ['decade', 'year', 'gender', 'artist_strip', 'title', 'section', 'line', 'token'],
-    'level' : 7,
-    'splitter' : '<l>',
-    'col_name_initial' : 'section_lyrics',
-    'col_name_new' : 'line_lyrics'
-} 
-
-line2token_params = {
-    'aws_client' : s3,
-    'input_file' : 'data/LINE-REDUCED.csv',
-    'output_folder' : 'data',
-    'temp_folder' : '..\\data\\temp',
-    'aws_bucket' : 'country-bucket-guler',
-    'output_name' : 'TOKEN-REDCUED.csv',
-    'OHCO' : ['decade', 'year', 'gender', 'artist_strip', 'title', 'section', 'line', 'token'],
-    'level' : 8,
-    'splitter' : ' ',
-    'col_name_initial' : 'line_lyrics',
-    'col_name_new' : 'TOKEN'
-} 
-
-cf.collapse_and_save(**corpus2line_params)
-cf.collapse_and_save(**sec2line_params)
-cf.collapse_and_save(**line2token_params)
\ No newline at end of file
+cf.collapse_corpus(**collapse_params)
\ No newline at end of file
@@ -0,0 +1,421 @@
+'''
+BENCHMARKS - TEXT-PROCESSING HOT PATHS ON A SEEDED SYNTHETIC CORPUS
+
+times the corpus functions in country_functions at 1x, 10x and 100x the pulled corpus without S3 or Genius,
+and appends throughput and peak memory per stage to a results file so runs can be compared for regressions
+'''
+
+##########
+# STEP 0 - IMPORT NECESSARY PACKAGES AND SET PARAMETERS
+##########
+
+import numpy as np
+import os
+import json
+import pandas as pd
+import sys
+import time
+import datetime
+import platform
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from string import punctuation
+from gensim.models import KeyedVectors
+
+import country_functions as cf
+
+SEED = 2022
+BASE_SONGS = 10000 # roughly the size of the pulled corpus (1x)
+SCALES = [1, 10, 100] # 100x needs a large machine, token-level stages hold ~250M tokens
+VOCAB_WORDS = 20000 # distinct synthetic words, drawn with zipf frequencies
+RNN_VOCAB = 1000 # vocab kept for the RNN (reduce / replace_with_similar), as in the notebooks
+EMBEDDING_DIM = 50 # fake embedding standing in for glove, random vectors over the synthetic words
+REFERENCE_MAX_ROWS = 20000 # per-row reference versions are timed on the first rows only (they take hours on the full corpus)
+BATCH_SIZE = 16 # as in the notebooks
+SEQ_LENGTH = 200
+REGRESSION_TOLERANCE = 0.2 # flag stages more than 20% slower than the previous run
+
+OHCO = ['decade', 'year', 'gender', 'artist_strip', 'title', 'section', 'line', 'token']
+WORK_FOLDER = os.path.join('..', 'data', 'benchmarks', 'work') # cached synthetic corpora and stage outputs
+RESULTS_FILE = os.path.join('..', 'data', 'benchmarks', 'results.jsonl') # one json record per stage and scale, appended
+
+##########
+# STEP 1 - SYNTHETIC LYRICS AND CHART METADATA
+##########
+
+COMMON_WORDS = ['i', 'you', 'the', 'and', 'a', 'my', 'me', 'to', 'it', 'in', 'love', 'your', 'on', 'that', 'of', 'oh', 'baby',
+                'all', 'be', 'like', 'when', 'just', 'down', 'night', 'heart', 'good', 'home', 'road', 'whiskey', 'truck']
+STOCK_LINES = 300 # lines shared across songs ('oh oh oh', 'yeah yeah'), sampled with zipf frequencies
+STOCK_LINE_SHARE = 0.05
+
+def synthetic_words(n_words, seed=SEED):
+    '''
+    GOAL - distinct pronounceable fake words (common english words first), ~3% dropping their g like "lovin'"
+    INPUTS -
+        n_words - number of words
+        seed - random seed, words only depend on the seed (same vocabulary at every scale)
+    OUTPUTS -
+        words - object array, position = frequency rank
+    '''
+    rng = np.random.default_rng(seed)
+    syllables = np.array([c + v for c in 'bcdfghjklmnprstvwy' for v in ['a', 'e', 'i', 'o', 'u', 'ay', 'ee', 'ou']], dtype=object)
+
+    words = list(COMMON_WORDS)
+    while len(words) < n_words:
+        n = 2 * n_words
+        lens = rng.integers(1, 4, n)
+        parts = syllables[rng.integers(0, len(syllables), (n, 3))]
+        candidates = [''.join(p[:l]) for p, l in zip(parts, lens)]
+        candidates = [w + "in'" if drop else w for w, drop in zip(candidates, rng.random(n) < 0.03)]
+        words = list(dict.fromkeys(words + candidates))
+    return np.array(words[:n_words], dtype=object)
+
+def synthetic_lines(n_lines, words, rng, mean_words=7):
+    '''
+    GOAL - lyric lines of zipf-distributed words, capitalised, some ending in punctuation
+    '''
+    p = 1 / np.arange(1, len(words) + 1) ** 1.07
+    lens = rng.poisson(mean_words - 1, n_lines) + 1
+    flat = words[rng.choice(len(words), lens.sum(), p=p / p.sum())]
+    ends = np.cumsum(lens)
+    endings = rng.choice(['', ',', '!', '?', '...'], n_lines, p=[0.7, 0.18, 0.05, 0.04, 0.03])
+    return [' '.join(flat[e-l:e]).capitalize() + ending for e, l, ending in zip(ends, lens, endings)]
+
+def synthetic_corpus(n_songs, seed=SEED):
+    '''
+    GOAL - seeded corpus shaped like CORPUS (chart metadata + genius lyrics): verses, a chorus repeated after every verse,
+           an optional bridge, genius section headers and the trailing "<n>Embed" lyricsgenius leaves on every song
+    INPUTS -
+        n_songs - number of songs (slightly fewer come back, duplicate artist/title pairs are dropped)
+        seed - random seed
+    OUTPUTS -
+        corpus - dataframe with a lyrics column, indexed by OHCO[:5]
+    '''
+    rng = np.random.default_rng([seed, n_songs])
+    words = synthetic_words(VOCAB_WORDS, seed)
+
+    # chart metadata
+    year = rng.integers(1959, 2023, n_songs)
+    artists = np.array([' '.join(pair) for pair in words[rng.integers(30, 5000, (max(n_songs // 8, 1), 2))]], dtype=object)
+    artist_p = 1 / np.arange(1, len(artists) + 1) ** 0.8
+    meta = pd.DataFrame({'decade' : year // 10 * 10,
+                         'year' : year,
+                         'artist_strip' : artists[rng.choice(len(artists), n_songs, p=artist_p / artist_p.sum())]})
+    meta['gender'] = rng.choice(['m', 'f', 'd'], len(artists), p=[0.65, 0.3, 0.05])[pd.factorize(meta.artist_strip)[0]]
+    title_lens = rng.integers(1, 5, n_songs)
+    title_words = words[rng.integers(10, 3000, (n_songs, 4))]
+    meta['title'] = [' '.join(t[:l]).title() for t, l in zip(title_words, title_lens)]
+
+    # song structure, every distinct line drawn once up front
+    n_verses = rng.integers(2, 4, n_songs)
+    verse_lines = rng.integers(4, 9, n_songs)
+    chorus_lines = rng.integers(4, 7, n_songs)
+    bridge_lines = np.where(rng.random(n_songs) < 0.4, 4, 0)
+    headers = rng.random(n_songs) < 0.7
+    n_distinct = n_verses * verse_lines + chorus_lines + bridge_lines
+
+    lines = np.array(synthetic_lines(n_distinct.sum(), words, rng), dtype=object)
+    stock = np.array(synthetic_lines(STOCK_LINES, words[:200], rng, mean_words=3), dtype=object)
+    shared = rng.random(len(lines)) < STOCK_LINE_SHARE
+    stock_p = 1 / np.arange(1, STOCK_LINES + 1)
+    lines[shared] = stock[rng.choice(STOCK_LINES, shared.sum(), p=stock_p / stock_p.sum())]
+
+    lyrics = []
+    offsets = np.cumsum(n_distinct) - n_distinct
+    titles = meta.title.tolist()
+    embeds = rng.integers(1, 200, n_songs)
+    for i in range(n_songs):
+        song = lines[offsets[i]:offsets[i] + n_distinct[i]]
+        verses = song[:n_verses[i] * verse_lines[i]].reshape(n_verses[i], verse_lines[i])
+        chorus = '\n'.join(song[n_verses[i] * verse_lines[i]:][:chorus_lines[i]])
+        chorus = '[Chorus]\n' + chorus if headers[i] else chorus
+
+        sections = []
+        for v, verse in enumerate(verses):
+            sections.append(('[Verse {}]\n'.format(v + 1) if headers[i] else '') + '\n'.join(verse))
+            sections.append(chorus)
+            if bridge_lines[i] and v == len(verses) - 2:
+                sections.append(('[Bridge]\n' if headers[i] else '') + '\n'.join(song[-bridge_lines[i]:]))
+        lyrics.append(titles[i] + ' Lyrics' + '\n\n'.join(sections) + str(embeds[i]) + 'Embed')
+
+    meta['lyrics'] = lyrics
+    meta = meta.drop_duplicates(['artist_strip', 'title'])
+    return meta.set_index(OHCO[:5])
+
+def synthetic_embeddings(words, dim=EMBEDDING_DIM, coverage=0.95, seed=SEED):
+    '''
+    GOAL - small fake word embedding (gensim KeyedVectors with random vectors) over most of the synthetic words,
+           the missing ones end up as 'no match' like out-of-glove words do
+    '''
+    rng = np.random.default_rng(seed)
+    keys = [word for word, keep in zip(words, rng.random(len(words)) < coverage) if keep]
+    embeddings = KeyedVectors(dim)
+    embeddings.add_vectors(keys, rng.standard_normal((len(keys), dim)).astype(np.float32))
+    return embeddings
+
+def corpus_path(scale):
+    return os.path.join(WORK_FOLDER, f'corpus-{SEED}-{BASE_SONGS * scale}.pkl')
+
+def load_corpus(scale):
+    '''
+    GOAL - synthetic corpus for a scale, generated once and cached in WORK_FOLDER
+    '''
+    path = corpus_path(scale)
+    if not os.path.exists(path):
+        os.makedirs(WORK_FOLDER, exist_ok=True)
+        synthetic_corpus(BASE_SONGS * scale).to_pickle(path + '.part')
+        os.replace(path + '.part', path)
+    return pd.read_pickle(path)
+
+##########
+# STEP 2 - BENCHMARKED STAGES
+##########
+
+# each stage does its (untimed) setup and returns the unit counted, the number of units and the function to time
+
+def _line_table(corpus):
+    prepped = cf.prep_corpus(corpus.lyrics, punctuation)
+    sections = cf.explode_level(prepped, '<s>', OHCO[:6])
+    sections = sections.mask(sections == '', 'nan')
+    lines = cf.explode_level(sections, '<l>', OHCO[:7])
+    return lines.mask(lines == '', 'nan')
+
+def _token_table(corpus):
+    tokens = cf.explode_level(_line_table(corpus), ' ', OHCO)
+    return tokens.mask(tokens == '', 'nan').to_frame('token').reset_index(OHCO[:5]).reset_index(drop=True) # song keys + token, like TOKENS-RNN
+
+def _rnn_vocab(tokens):
+    return tokens.value_counts().index[:RNN_VOCAB].tolist()
+
+def _local_corpus(corpus, work):
+    backend = cf.LocalBackend(work)
+    reduced = corpus.assign(prepped=cf.prep_corpus(corpus.lyrics, punctuation))
+    cf.csv_to_s3(reduced, 'CORPUS-REDUCED.csv', None, None, aws_folder='data', backend=backend)
+    return backend
+
+def stage_prep_for_analysis(corpus, work):
+    lyrics = corpus.lyrics
+    return 'songs', len(lyrics), lambda: lyrics.apply(cf.prep_for_analysis, punctuation=punctuation)
+
+def stage_prep_corpus(corpus, work):
+    lyrics = corpus.lyrics
+    return 'songs', len(lyrics), lambda: cf.prep_corpus(lyrics, punctuation)
+
+def stage_collapse_and_save(corpus, work):
+    backend = _local_corpus(corpus, work)
+    return 'songs', len(corpus), lambda: cf.collapse_and_save(None, None, 'data/CORPUS-REDUCED.csv', 'data', None, 'SECTION-REDUCED.csv',
+                                                              OHCO, 6, '<s>', 'prepped', 'section_lyrics', backend=backend)
+
+def stage_collapse_corpus(corpus, work):
+    backend = _local_corpus(corpus, work)
+    return 'songs', len(corpus), lambda: cf.collapse_corpus(None, None, 'data/CORPUS-REDUCED.csv', 'data',
+                                                            ['SECTION-REDUCED', 'LINE-REDUCED', 'TOKEN-REDCUED'], OHCO, 6,
+                                                            ['<s>', '<l>', ' '], 'prepped', ['section_lyrics', 'line_lyrics', 'TOKEN'],
+                                                            backend=backend, table_format='parquet')
+
+def stage_tokenize_tag(corpus, work):
+    lines = _line_table(corpus).iloc[:REFERENCE_MAX_ROWS].to_frame('line_lyrics').reset_index()
+    return 'lines', len(lines), lambda: cf.tokenize_tag(lines, OHCO, 'line_lyrics')
+
+def stage_tokenize_tag_batched(corpus, work):
+    lines = _line_table(corpus).to_frame('line_lyrics').reset_index()
+    return 'lines', len(lines), lambda: cf.tokenize_tag_batched(lines, OHCO, 'line_lyrics')
+
+def stage_reduce(corpus, work):
+    tokens = _token_table(corpus).token
+    vocab = _rnn_vocab(tokens)
+    sample = tokens.iloc[:REFERENCE_MAX_ROWS]
+    return 'tokens', len(sample), lambda: sample.apply(cf.reduce, vocab=vocab)
+
+def stage_reduce_tokens(corpus, work):
+    tokens = _token_table(corpus).token
+    vocab = _rnn_vocab(tokens)
+    return 'tokens', len(tokens), lambda: cf.reduce_tokens(tokens, vocab)
+
+def stage_replace_with_similar(corpus, work):
+    tokens = _token_table(corpus).token
+    vocab, embeddings = _rnn_vocab(tokens), synthetic_embeddings(synthetic_words(VOCAB_WORDS))
+    sample = tokens.iloc[:REFERENCE_MAX_ROWS]
+    return 'tokens', len(sample), lambda: sample.apply(cf.replace_with_similar, embeddings=embeddings, vocab=vocab)
+
+def stage_replace_with_similar_tokens(corpus, work):
+    tokens = _token_table(corpus).token
+    vocab, embeddings = _rnn_vocab(tokens), synthetic_embeddings(synthetic_words(VOCAB_WORDS))
+    return 'tokens', len(tokens), lambda: cf.replace_with_similar_tokens(tokens, embeddings, vocab)
+
+def stage_encode_corpus(corpus, work):
+    tokens = _token_table(corpus)
+    return 'tokens', len(tokens), lambda: cf.encode_corpus(tokens, OHCO, os.path.join(work, 'encoded'))
+
+def _train_tokens(corpus, work):
+    encoded = cf.encode_corpus(_token_table(corpus), OHCO, os.path.join(work, 'encoded'))
+    order = np.random.default_rng(SEED).permutation(len(encoded.songs)) # shuffled songs, as the notebook train split
+    return encoded.take(order)
+
+def stage_get_all_batches(corpus, work):
+    lyrics = _train_tokens(corpus, work)
+
+    def run():
+        # the advanced-model epoch loop: every batch pulled out of the strided views as a contiguous array
+        batches_x, batches_y = cf.get_all_batches(lyrics, BATCH_SIZE, SEQ_LENGTH)
+        for x, y in zip(batches_x, batches_y):
+            np.ascontiguousarray(x), np.ascontiguousarray(y)
+
+    return 'tokens', len(lyrics), run
+
+def stage_get_batch(corpus, work):
+    lyrics = _train_tokens(corpus, work)
+    num_batches = len(lyrics) // (BATCH_SIZE * SEQ_LENGTH)
+
+    def run():
+        # the simple-implementation training loop, one random-offset batch per iteration
+        np.random.seed(SEED)
+        for i in range(num_batches):
+            cf.get_batch(lyrics, SEQ_LENGTH, BATCH_SIZE)
+
+    return 'tokens', num_batches * BATCH_SIZE * SEQ_LENGTH, run
+
+STAGES = {'prep_for_analysis' : stage_prep_for_analysis,
+          'prep_corpus' : stage_prep_corpus,
+          'collapse_and_save' : stage_collapse_and_save,
+          'collapse_corpus' : stage_collapse_corpus,
+          'tokenize_tag' : stage_tokenize_tag,
+          'tokenize_tag_batched' : stage_tokenize_tag_batched,
+          'reduce' : stage_reduce,
+          'reduce_tokens' : stage_reduce_tokens,
+          'replace_with_similar' : stage_replace_with_similar,
+          'replace_with_similar_tokens' : stage_replace_with_similar_tokens,
+          'encode_corpus' : stage_encode_corpus,
+          'get_all_batches' : stage_get_all_batches,
+          'get_batch' : stage_get_batch}
+
+SAMPLED_STAGES = ['tokenize_tag', 'reduce', 'replace_with_similar'] # timed on REFERENCE_MAX_ROWS rows at every scale
+
+##########
+# STEP 3 - RUN STAGES IN FRESH PROCESSES AND RECORD RESULTS
+##########
+
+def _rss_mb(field):
+    # VmRSS (current) or VmHWM (peak) from /proc, linux only (None elsewhere)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _reset_peak_rss():
+    # clear the peak rss high-water mark so it only covers the stage (linux 4.0+)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def run_stage(name, scale):
+    '''
+    GOAL - set up and time one stage on the synthetic corpus of a scale (run in a fresh process so peak memory is its own)
+    INPUTS -
+        name - key of STAGES
+        scale - corpus multiple of BASE_SONGS
+    OUTPUTS -
+        result - dict with units processed, wall time, throughput and memory before / at peak of the stage (MB)
+    '''
+    work = os.path.join(WORK_FOLDER, f'{name}-{scale}x')
+    cf.load_all() # submodules load lazily, keep their import out of the timed stage
+    unit, n, func = STAGES[name](load_corpus(scale), work)
+
+    rss_before = _rss_mb('VmRSS')
+    peak_is_stage_only = _reset_peak_rss()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    peak = _rss_mb('VmHWM')
+
+    return {'unit' : unit,
+            'rows' : n,
+            'seconds' : seconds,
+            'rows_per_s' : n / seconds if seconds else None,
+            'rss_before_mb' : rss_before,
+            'peak_rss_mb' : peak,
+            'peak_is_stage_only' : peak_is_stage_only and peak is not None}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(stages=None, scales=SCALES, results_file=RESULTS_FILE):
+    '''
+    GOAL - run every stage at every scale, each in a fresh spawned process, appending one record per stage to results_file
+           (a failing or killed stage, e.g. out of memory at 100x, is recorded with its error and the rest still run)
+    INPUTS -
+        stages - list of STAGES keys, default all
+        scales - list of corpus multiples
+        results_file - json lines file the records are appended to
+    OUTPUTS -
+        results - dataframe of this run's records
+    '''
+    stages = stages if stages is not None else list(STAGES)
+    run = {'run_id' : datetime.datetime.now().isoformat(timespec='seconds'),
+           'commit' : _git_commit(),
+           'python' : platform.python_version(),
+           'pandas' : pd.__version__,
+           'numpy' : np.__version__,
+           'cpus' : os.cpu_count()}
+
+    os.makedirs(os.path.dirname(results_file), exist_ok=True)
+    records = []
+    for scale in scales:
+        load_corpus(scale) # generate once here, not in every stage process
+        for name in stages:
+            record = dict(run, stage=name, scale=scale, songs=BASE_SONGS * scale, sampled=name in SAMPLED_STAGES, error=None)
+            try:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    record.update(executor.submit(run_stage, name, scale).result())
+            except BrokenProcessPool:
+                record['error'] = 'stage process died (out of memory?)'
+            except Exception as e:
+                record['error'] = f"{type(e).__name__}: {' '.join(str(e).split())[:300]}" # nltk lookup errors span many lines
+
+            records.append(record)
+            with open(results_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+            print(f"{scale}x {name}: " + (record['error'] or f"{record['rows_per_s']:,.0f} {record['unit']}/s, peak {record['peak_rss_mb']} MB"),
+                  flush=True)
+
+    return pd.DataFrame(records)
+
+def compare_to_previous(results_file=RESULTS_FILE, run_id=None, tolerance=REGRESSION_TOLERANCE):
+    '''
+    GOAL - compare a run (default the latest) with the previous run of each stage and scale in results_file
+    INPUTS -
+        results_file - json lines file written by run_benchmarks
+        run_id - run to compare, default the latest
+        tolerance - relative throughput drop flagged as a regression
+    OUTPUTS -
+        comparison - dataframe of throughput and peak memory against the previous run, with a regression flag
+    '''
+    results = pd.read_json(results_file, lines=True, dtype={'run_id' : str})
+    results = results[results.error.isna()].sort_values('run_id', kind='stable')
+    run_id = run_id if run_id is not None else results.run_id.max()
+
+    current = results[results.run_id == run_id].set_index(['stage', 'scale'])
+    previous = results[results.run_id < run_id].groupby(['stage', 'scale']).last()
+
+    comparison = current[['unit', 'rows_per_s', 'peak_rss_mb']].join(previous[['rows_per_s', 'peak_rss_mb', 'commit']], rsuffix='_previous')
+    comparison['speed_ratio'] = comparison.rows_per_s / comparison.rows_per_s_previous
+    comparison['regression'] = comparison.speed_ratio < 1 - tolerance
+    return comparison
+
+if __name__ == '__main__': # stages run in spawned processes that import this file, so only the main process runs the suite
+    stages = sys.argv[1:] or None # e.g. python benchmark-hot-paths.py prep_corpus tokenize_tag_batched
+    run_benchmarks(stages)
+    print(compare_to_previous().to_string())
@@ -0,0 +1,135 @@
+'''
+BENCHMARKS - IMPORT TIME AND MEMORY OF COUNTRY_FUNCTIONS PER SCRIPT
+
+each script's imports plus the cf names it uses, loaded lazily (only the submodules defining those names) against
+eagerly (every submodule, as the single-module country_functions did), in fresh interpreters
+'''
+
+##########
+# STEP 0 - IMPORT NECESSARY PACKAGES AND SET PARAMETERS
+##########
+
+import os
+import ast
+import sys
+import json
+import regex as re
+import statistics
+import subprocess
+import pandas as pd
+
+SCRIPTS = ['1-pull-charts.py', '2-lib-features.py', '3-pull-lyrics.py', '4-create-prune-content-tables.py', 'run-pipeline.py']
+REPEATS = 5 # fresh interpreters per measurement, the median is kept
+HEAVY_MODULES = ['nltk', 'scipy', 'pyarrow', 'gensim', 'tensorflow', 'bs4', 'requests', 'boto3', 'regex'] # reported when loaded
+OLD_EAGER_IMPORTS = ['gensim.downloader'] # imported at load by the single-module country_functions (unused since)
+RESULTS_FILE = os.path.join('..', 'data', 'benchmarks', 'imports.json')
+
+repo = os.path.dirname(os.path.abspath(__file__))
+
+##########
+# STEP 1 - WHAT EACH SCRIPT IMPORTS AND USES
+##########
+
+def script_imports(path):
+    '''
+    GOAL - the script's own top-level import statements (country_functions excluded), as source lines
+    '''
+    tree = ast.parse(open(path, encoding='utf-8').read())
+    imports = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [alias.name for alias in node.names] if isinstance(node, ast.Import) else [node.module]
+            if not any(module.split('.')[0] == 'country_functions' for module in modules):
+                imports.append(ast.unparse(node))
+    return imports
+
+def script_names(path):
+    '''
+    GOAL - the cf.* names a script uses
+    '''
+    return sorted(set(re.findall(r'\bcf\.([A-Za-z_]\w*)', open(path, encoding='utf-8').read())))
+
+##########
+# STEP 2 - MEASURE IN FRESH INTERPRETERS
+##########
+
+PROBE = '''
+import sys, time, json, importlib
+start = time.perf_counter()
+{imports}
+imports_s = time.perf_counter() - start
+import country_functions as cf
+for name in {names!r}:
+    getattr(cf, name)
+if {eager!r}:
+    cf.load_all()
+    for module in {old_eager!r}:
+        importlib.import_module(module)
+total_s = time.perf_counter() - start
+rss = None
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) / 1024 for line in f if line.startswith('VmHWM:'))
+except OSError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+heavy = sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy!r}))
+print(json.dumps({{'imports_s' : imports_s, 'cf_s' : total_s - imports_s, 'total_s' : total_s, 'peak_rss_mb' : rss, 'heavy' : heavy}}))
+'''
+
+def measure(imports, names, eager, repeats=REPEATS):
+    '''
+    GOAL - median import time and peak rss over fresh interpreters
+    INPUTS -
+        imports - import lines run first (the script's own imports)
+        names - cf names to resolve
+        eager - also load every submodule (plus the old eager imports)
+        repeats - number of interpreters
+    OUTPUTS -
+        dict of median times (s), median peak rss (MB) and heavy packages loaded
+    '''
+    code = PROBE.format(imports='\n'.join(imports), names=names, eager=eager, old_eager=OLD_EAGER_IMPORTS, heavy=HEAVY_MODULES)
+    runs = []
+    for _ in range(repeats):
+        probe = subprocess.run([sys.executable, '-c', code], cwd=repo, capture_output=True, text=True)
+        if probe.returncode:
+            raise RuntimeError(probe.stderr.strip().split('\n')[-1]) # e.g. a package the script imports is not installed
+        runs.append(json.loads(probe.stdout.strip().split('\n')[-1]))
+    return {'imports_s' : statistics.median(run['imports_s'] for run in runs),
+            'cf_s' : statistics.median(run['cf_s'] for run in runs),
+            'total_s' : statistics.median(run['total_s'] for run in runs),
+            'peak_rss_mb' : statistics.median(run['peak_rss_mb'] for run in runs),
+            'heavy' : runs[0]['heavy']}
+
+def compare_scripts(scripts=SCRIPTS, repeats=REPEATS):
+    '''
+    GOAL - lazy against eager country_functions for each script
+    OUTPUTS -
+        results - dataframe with one row per script: time (script imports, cf alone, total) and peak rss for lazy and eager loading,
+                  the savings and the heavy packages lazy loading skips
+    '''
+    rows = []
+    for script in scripts:
+        path = os.path.join(repo, script)
+        imports, names = script_imports(path), script_names(path)
+        lazy = measure(imports, names, eager=False, repeats=repeats)
+        eager = measure(imports, names, eager=True, repeats=repeats)
+        rows.append({'script' : script,
+                     'cf_names' : len(names),
+                     'script_imports_s' : lazy['imports_s'],
+                     'lazy_cf_s' : lazy['cf_s'],
+                     'eager_cf_s' : eager['cf_s'],
+                     'lazy_s' : lazy['total_s'],
+                     'eager_s' : eager['total_s'],
+                     'saved_s' : eager['total_s'] - lazy['total_s'],
+                     'lazy_rss_mb' : lazy['peak_rss_mb'],
+                     'eager_rss_mb' : eager['peak_rss_mb'],
+                     'saved_rss_mb' : eager['peak_rss_mb'] - lazy['peak_rss_mb'],
+                     'not_loaded' : ' '.join(sorted(set(eager['heavy']) - set(lazy['heavy'])))})
+    return pd.DataFrame(rows).set_index('script')
+
+if __name__ == '__main__':
+    results = compare_scripts()
+    print(results.to_string(float_format='{:.2f}'.format))
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    results.reset_index().to_json(RESULTS_FILE, orient='records', indent=1)
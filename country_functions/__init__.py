@@ -0,0 +1,63 @@
+##########
+# Functions to assist with country lyrics project
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+'''
+country_functions is split into submodules, each imported the first time one of its names is used, so a script only pays
+for the stacks it needs (1-pull-charts never loads nltk, scipy or pyarrow):
+    run_report - stage timing / io instrumentation and the json run report
+    storage - S3, local and cached storage backends, csv and parquet tables
+    scraping - billboard chart pulls, chart tables (artists, song stats) and genius lyrics
+    corpus - corpus preprocessing, OHCO collapse, tokenizing and tagging
+    rnn_prep - vocab reduction, integer-encoded corpus and document-term matrix
+    rnn - batching, evaluation, checkpoints and generation
+    pipeline - stage runner for the numbered scripts and notebooks
+the flat api is unchanged, cf.csv_to_s3, cf.prep_corpus, ... resolve to the submodule defining them
+'''
+
+import importlib
+
+SUBMODULES = {
+    'run_report' : ['Instrumentation', 'instrumentation', '_peak_rss_mb', '_reset_peak_rss', '_is_table', '_n_rows', 'instrumented',
+                    '_CountingReader', 'RUN_REPORT_ENV', 'start_run_report'],
+    'storage' : ['STREAM_CHUNK_ROWS', 'MULTIPART_CHUNK_BYTES', 'S3Backend', 'LocalBackend', 'CACHE_MAX_BYTES',
+                 'CachedBackend', 'open_storage', 'compressed_writer', '_Unclosable', 'write_csv', 'TableWriter', '_AbortableReader',
+                 '_stream_csv', 'csv_to_s3', 'csv_from_s3', 'PARQUET_ROW_GROUP_ROWS', '_require_pyarrow', 'OHCO_PARQUET_TYPES',
+                 'parquet_schema', 'ParquetTableWriter', 'PartitionedTableWriter', 'table_to_s3', 'table_from_s3', 'compare_table_formats',
+                 'list_files'],
+    'scraping' : ['CHART_USER_AGENT', 'CHART_ROW_CLASS', 'CHART_PARSER', 'pull_charts', 'parse_charts', 'RateLimiter',
+                  'make_chart_session', 'fetch_chart_html', 'pull_charts_concurrent', 'CHART_DTYPES', 'chart_date_from_key',
+                  'combine_charts', 'read_charts', 'ARTIST_SEPARATORS', 'normalize_artists', 'song_id', 'ArtistAliases', 'SongStats',
+                  'get_lyrics', 'LyricsCache', 'get_lyrics_concurrent', 'LYRICS_COMPACT_SHARDS', 'LyricsStore'],
+    'corpus' : ['collapse_and_save', 'explode_level', 'collapse_corpus', 'prep_for_analysis', 'tokenize_tag', '_tag_lines',
+                'tokenize_tag_batched', 'compare_tokenize_tag', 'is_clean', 'PREP_SEPARATOR', 'punctuation_table', '_prep_chunk',
+                'prep_corpus', 'word_counts', 'clean_mask'],
+    'rnn_prep' : ['reduce', 'replace_with_similar', 'reduce_tokens', 'similar_in_vocab', 'replace_with_similar_tokens', 'encode_corpus',
+                  'EncodedCorpus', 'DocumentTermMatrix'],
+    'rnn' : ['get_all_batches', 'iter_batches', 'get_batch', 'StreamingEvaluator', 'TrainingCheckpoints', 'LossLog',
+             'temperature_processor', 'top_k_processor', 'topic_processor', 'reset_model_states', 'generate_songs',
+             'EmbeddingNeighbours', 'TopicWeightBank'],
+    'pipeline' : ['PIPELINE_STATE_KEY', 'PIPELINE_FINGERPRINT_ENV', 'PipelineStage', 'file_hash', 'storage_etags', '_keys_overlap',
+                  'PipelineRunner'],
+}
+
+_MODULE_OF = {name : module for module, names in SUBMODULES.items() for name in names}
+
+def __getattr__(name):
+    module = _MODULE_OF.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value # later lookups are plain attribute reads
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULE_OF))
+
+def load_all():
+    '''
+    GOAL - import every submodule up front (e.g. before forking workers), the single-module behaviour
+    '''
+    for module in SUBMODULES:
+        importlib.import_module('.' + module, __name__)
@@ -0,0 +1,314 @@
+##########
+# Functions to assist with country lyrics project - corpus preprocessing, OHCO collapse, tokenizing and tagging
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import time
+import itertools
+import functools
+import nltk
+
+from .run_report import instrumented
+from .storage import S3Backend, TableWriter, PartitionedTableWriter
+
+##########
+# SECTION III - PROCESSING CORPUS (MAIN)
+##########
+
+@instrumented
+def collapse_and_save(aws_client, aws_bucket, input_file, output_folder, temp_folder, output_name, OHCO, level, splitter, col_name_initial, col_name_new, 
+                      backend=None):
+    
+    '''
+    GOAL - collapse OHCO by one level while pruning for invalid responses (mispulled novels, TV episodes, etc) based on section length
+    INPUTS - 
+        aws_client - AWS client associated with folder (AWS client object)
+        aws_bucket - name of S3 bucket (str)
+        input_file - name of original (pre-collapse) table in S3 (including folder)
+        output_folder - destination folder for collapsed output (S3)
+        temp_folder (deprecated) - no longer used, kept so existing calls keep working
+        output_name - filename for collpased table
+        OHCO - list of OHCO names
+        level - (int), OHCO level of collapsed table
+        splitter - str used for splitting (e.g. '\n\n')
+        limit (deprecated) - maximum length of post-split section (e.g. if you dont want sections with more than 100 lines, this would be 100)
+        col_name_initial - content column name (separate from OHCO, e.g. 'section_lyrics') for pre-collapse table
+        col_name_new - content column name (separate from OHCO, e.g. 'line_lyrics') for post-collapse table
+        backend (optional) - storage backend replacing aws_client/aws_bucket (e.g. LocalBackend)
+    OUTPUTS - 
+        no returned outputs - processes table and saves to S3
+    '''
+    
+    collapse_corpus(aws_client, aws_bucket, input_file, output_folder, [output_name], OHCO, level, [splitter], col_name_initial, [col_name_new], 
+                    backend=backend)
+    
+def explode_level(content : pd.Series, splitter : str, names):
+    '''
+    GOAL - split each content string into one row per piece (explode semantics), numbering pieces within their parent row
+    INPUTS - 
+        content - series of strings indexed by the parent OHCO levels
+        splitter - str used for splitting (e.g. '<s>')
+        names - OHCO names of the exploded index (parent levels plus the new level)
+    OUTPUTS - 
+        pieces - series of stripped pieces indexed by names
+    '''
+    split = content.str.split(splitter, regex=False)
+    lens = split.str.len().to_numpy(dtype=np.int64)
+    pieces = split.explode()
+    
+    # position of each piece within its own parent row (not its index group, which may repeat)
+    positions = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    
+    parent = pieces.index
+    pieces.index = pd.MultiIndex.from_arrays([parent.get_level_values(i) for i in range(parent.nlevels)] + [positions], names=names)
+    return pieces.str.strip()
+
+@instrumented
+def collapse_corpus(aws_client, aws_bucket, input_file, output_folder, output_names, OHCO, level, splitters, col_name_initial, col_names_new, 
+                    chunk_rows=2000, backend=None, table_format='csv'):
+    '''
+    GOAL - collapse OHCO by several levels in a single pass (e.g. corpus -> section -> line -> token), reading the input in chunks
+           and streaming every level to its own table as it goes, so memory stays proportional to a chunk of songs
+    INPUTS - 
+        aws_client - AWS client associated with folder (AWS client object)
+        aws_bucket - name of S3 bucket (str)
+        input_file - name of original (pre-collapse) table in S3 (including folder)
+        output_folder - destination folder for collapsed outputs (S3)
+        output_names - list of filenames, one per collapsed level
+        OHCO - list of OHCO names
+        level - (int), OHCO level of the first collapsed table, the input is indexed by OHCO[:level-1]
+        splitters - list of str used for splitting, one per collapsed level (e.g. ['<s>', '<l>', ' '])
+        col_name_initial - content column name in the input table (e.g. 'prepped')
+        col_names_new - list of content column names, one per collapsed level (e.g. ['section_lyrics', 'line_lyrics', 'TOKEN'])
+        chunk_rows - number of input rows (songs) processed at a time
+        backend (optional) - storage backend replacing aws_client/aws_bucket
+        table_format - 'csv', or 'parquet' for decade-partitioned parquet datasets (output_names are then folder names, 
+                       read back with table_from_s3)
+    OUTPUTS - 
+        no returned outputs - processes table and saves one table per level to S3
+    '''
+    backend = backend if backend is not None else S3Backend(aws_client, aws_bucket)
+    if table_format == 'parquet':
+        writers = [PartitionedTableWriter(backend, output_folder + '/' + output_name, OHCO[0]) for output_name in output_names]
+    else:
+        writers = [TableWriter(backend, output_folder + '/' + output_name) for output_name in output_names]
+    
+    try:
+        for chunk in pd.read_csv(backend.get_fileobj(input_file), chunksize=chunk_rows):
+            content = chunk.set_index(OHCO[:level-1])[col_name_initial].fillna('nan').astype(str)
+            
+            for i, (splitter, col_name_new, writer) in enumerate(zip(splitters, col_names_new, writers)):
+                content = explode_level(content, splitter, OHCO[:level+i])
+                writer.write(content.to_frame(col_name_new))
+                
+                # the level-by-level process re-read each level from csv, where empty pieces come back as 'nan'
+                content = content.mask(content == '', 'nan')
+    except BaseException:
+        for writer in writers:
+            writer.aborted = True
+        raise
+    finally:
+        errors = []
+        for writer in writers:
+            try:
+                writer.close()
+            except Exception as e:
+                errors.append(e)
+    if errors:
+        raise errors[0]
+    
+def prep_for_analysis(song : str, punctuation : str):
+    '''
+    GOAL - prep song lyrics for analysis by converting to lowercase, removing punctuation, and replacing symbols and spaces with end tokens
+           meant to be applied to column in dataframe
+    INPUTS - 
+        song - lyrics to song
+        punctuation - string containing list of all punctuation to remove (can be imported from string package)
+    OUTPUTS - 
+        prepped - a processed version of the string
+    '''    
+    prepped = song.translate({ord(punc): '' for punc in punctuation}) # remove punc
+    prepped = ' '.join(prepped.lower().replace('\n\n', ' <s> ').replace('\n', ' <l> ').replace('embed', ' <e>').split()) # convert to lower and replace end tokens
+    return prepped
+
+@instrumented
+def tokenize_tag(line_level : pd.DataFrame, OHCO, col_name):
+    '''
+    GOAL - tokenize lines using nltk's POS tagger and create collapsed token table
+    INPUTS - 
+        line_level - dataframe of corpus at the line level (equivalent of sentence, typical level for pos tagging)
+        OHCO - list of OHCO names
+        col_name - name of column in line_level where content is stored (e.g. "line_lyrics")
+    OUTPUTS - 
+        tokens - a table of tokens and their POS at the full OHCO level
+    '''    
+    line_level = line_level.set_index(OHCO[:-1])
+
+    tokens = line_level[col_name].apply(lambda x: pd.Series(nltk.pos_tag(nltk.word_tokenize(x))))\
+                .stack()\
+                .to_frame('pos_tuple')
+
+    tokens['token'] = tokens.pos_tuple.apply(lambda x : x[0])
+    tokens['pos'] = tokens.pos_tuple.apply(lambda x : x[1])
+    tokens.index.names = OHCO
+    
+    return tokens[['token', 'pos']]
+
+def _tag_lines(lines):
+    # tokenize and tag a batch of lines (module level so it can run in a process pool)
+    return nltk.pos_tag_sents([nltk.word_tokenize(line) for line in lines])
+
+@instrumented
+def tokenize_tag_batched(line_level : pd.DataFrame, OHCO, col_name, cache=None, batch_size=2000, n_jobs=1):
+    '''
+    GOAL - same output as tokenize_tag, but each distinct line is tagged only once (choruses repeat), lines are tagged
+           in batches with pos_tag_sents, optionally across a process pool, and the token table is built with array ops
+    INPUTS - 
+        line_level - dataframe of corpus at the line level (equivalent of sentence, typical level for pos tagging)
+        OHCO - list of OHCO names
+        col_name - name of column in line_level where content is stored (e.g. "line_lyrics")
+        cache (optional) - dict of line -> list of (token, pos) tuples, reused and filled across calls
+        batch_size - number of distinct lines per pos_tag_sents call
+        n_jobs - number of processes used for tagging (1 tags in this process)
+    OUTPUTS - 
+        tokens - a table of tokens and their POS at the full OHCO level
+    '''
+    line_level = line_level.set_index(OHCO[:-1])
+    cache = cache if cache is not None else {}
+    
+    # tag each distinct line not already in the cache
+    codes, uniques = pd.factorize(line_level[col_name], use_na_sentinel=False)
+    to_tag = [line for line in uniques if line not in cache]
+    batches = [to_tag[i:i+batch_size] for i in range(0, len(to_tag), batch_size)]
+    if n_jobs > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            tagged_batches = list(executor.map(_tag_lines, batches))
+    else:
+        tagged_batches = [_tag_lines(batch) for batch in batches]
+    cache.update(zip(to_tag, itertools.chain.from_iterable(tagged_batches)))
+    
+    # flat token/pos arrays over the distinct lines, then gather them for every line
+    tagged = [cache[line] for line in uniques]
+    unique_lens = np.fromiter((len(t) for t in tagged), dtype=np.int64, count=len(tagged))
+    unique_offsets = np.cumsum(unique_lens) - unique_lens
+    unique_tokens = np.array([token for t in tagged for token, _ in t], dtype=object)
+    unique_pos = np.array([pos for t in tagged for _, pos in t], dtype=object)
+    
+    lens = unique_lens[codes]
+    positions = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    flat = np.repeat(unique_offsets[codes], lens) + positions
+    
+    parent = line_level.index[np.repeat(np.arange(len(line_level)), lens)]
+    parent = parent if isinstance(parent, pd.MultiIndex) else pd.MultiIndex.from_arrays([parent])
+    index = pd.MultiIndex.from_arrays([parent.get_level_values(i) for i in range(parent.nlevels)] + [positions], names=OHCO)
+    
+    return pd.DataFrame({'token' : unique_tokens[flat], 'pos' : unique_pos[flat]}, index=index)
+
+def compare_tokenize_tag(line_level : pd.DataFrame, OHCO, col_name, **batched_kwargs):
+    '''
+    GOAL - time tokenize_tag against tokenize_tag_batched on the same lines and check that both give the same table
+    INPUTS - 
+        line_level, OHCO, col_name - as in tokenize_tag
+        batched_kwargs - passed on to tokenize_tag_batched (batch_size, n_jobs)
+    OUTPUTS - 
+        report - dict with line counts, run times (s), speedup and whether outputs match
+    '''
+    start = time.perf_counter()
+    original = tokenize_tag(line_level, OHCO, col_name)
+    original_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    batched = tokenize_tag_batched(line_level, OHCO, col_name, **batched_kwargs)
+    batched_time = time.perf_counter() - start
+    
+    return {'n_lines' : len(line_level), 
+            'n_distinct_lines' : line_level[col_name].nunique(), 
+            'tokenize_tag_s' : original_time, 
+            'tokenize_tag_batched_s' : batched_time, 
+            'speedup' : original_time / batched_time, 
+            'same_output' : original.astype(str).equals(batched.astype(str))}
+
+def is_clean(string, pattern):
+    '''
+    GOAL - determine whether a string meets a particular pattern (necessary to functionize rather than lambda due to if/else)
+    INPUTS - 
+        string - the string to be searched for the pattern
+        pattern - regex pattern for comparison
+        col_name - name of column in line_level where content is stored (e.g. "line_lyrics")
+    OUTPUTS - 
+        False if pattern identified, true otherwise
+    '''    
+    if pattern.search(string):
+        return False
+    else:
+        return True
+    
+PREP_SEPARATOR = '\x00' # joins songs into one string for corpus-level preprocessing, must not occur in lyrics
+
+@functools.lru_cache(maxsize=None)
+def punctuation_table(punctuation : str):
+    '''
+    GOAL - translation table deleting all punctuation, built once per punctuation string
+    '''
+    return str.maketrans('', '', punctuation)
+
+def _prep_chunk(songs, punctuation):
+    # prep_for_analysis over a list of songs, done on one joined string so every step runs once in C
+    joined = PREP_SEPARATOR.join(songs)
+    if PREP_SEPARATOR in punctuation or joined.count(PREP_SEPARATOR) != len(songs) - 1:
+        return [prep_for_analysis(song, punctuation) for song in songs]
+    
+    if punctuation.isascii(): # ascii bytes never occur inside multi-byte utf-8 characters, so deleting them as bytes is safe (and much faster)
+        prepped = joined.encode('utf-8', 'surrogatepass').translate(None, punctuation.encode('ascii')).decode('utf-8', 'surrogatepass')
+    else:
+        prepped = joined.translate(punctuation_table(punctuation))
+    prepped = prepped.lower()
+    prepped = prepped.replace('\n\n', ' <s> ').replace('\n', ' <l> ').replace('embed', ' <e>')
+    prepped = ' '.join(prepped.split()) # separator is not whitespace, so it survives as its own word
+    prepped = prepped.replace(' ' + PREP_SEPARATOR, PREP_SEPARATOR).replace(PREP_SEPARATOR + ' ', PREP_SEPARATOR)
+    return prepped.split(PREP_SEPARATOR)
+
+@instrumented
+def prep_corpus(lyrics : pd.Series, punctuation : str, chunk_size=5000, n_jobs=1):
+    '''
+    GOAL - corpus-level version of prep_for_analysis (same output, song for song), processing whole chunks of songs at once
+    INPUTS - 
+        lyrics - series of song lyrics
+        punctuation - string containing list of all punctuation to remove (can be imported from string package)
+        chunk_size - number of songs processed at a time
+        n_jobs - number of processes used (1 runs in this process)
+    OUTPUTS - 
+        prepped - series of processed lyrics with the same index as lyrics
+    '''
+    songs = lyrics.astype(str).tolist()
+    chunks = [songs[i:i+chunk_size] for i in range(0, len(songs), chunk_size)]
+    if n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            prepped = list(executor.map(_prep_chunk, chunks, itertools.repeat(punctuation)))
+    else:
+        prepped = [_prep_chunk(chunk, punctuation) for chunk in chunks]
+    return pd.Series(list(itertools.chain.from_iterable(prepped)), index=lyrics.index, dtype=object, name=lyrics.name)
+
+def word_counts(lyrics : pd.Series):
+    '''
+    GOAL - number of space-separated words per song, same as len(x.split(' ')) per song
+    '''
+    return lyrics.astype(str).str.count(' ') + 1
+
+def clean_mask(strings : pd.Series, pattern):
+    '''
+    GOAL - series version of is_clean, one vectorized str.contains over the whole series instead of a search per string
+    INPUTS - 
+        strings - series of strings to be searched for the pattern
+        pattern - regex pattern for comparison, a str or a compiled re pattern (e.g. re.compile('[^\\x00-\\x7F]'))
+    OUTPUTS - 
+        boolean series, False where the pattern is found, True otherwise (same as is_clean per string)
+    '''
+    return ~strings.astype(str).str.contains(pattern, regex=True)
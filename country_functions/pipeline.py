@@ -0,0 +1,232 @@
+##########
+# Functions to assist with country lyrics project - pipeline runner
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import datetime
+import json
+import io
+import os
+import hashlib
+import subprocess
+import graphlib
+
+from .storage import MULTIPART_CHUNK_BYTES
+
+##########
+# SECTION VI - PIPELINE RUNNER
+##########
+
+PIPELINE_STATE_KEY = 'data/pipeline/state.json'
+PIPELINE_FINGERPRINT_ENV = 'PIPELINE_FINGERPRINT' # shell stages find their fingerprint here (e.g. to key training checkpoints on)
+
+class PipelineStage:
+    """
+    GOAL - one stage of the pipeline (numbered script, notebook or function) with the storage keys it reads and writes
+    INPUTS - 
+        name - stage name (str)
+        run - shell command (list of str, run from the repo folder) or function called without arguments
+        inputs - storage keys read by the stage, keys ending in '/' are folders (every key under them counts)
+        outputs - storage keys written by the stage (same convention), keys in both lists are state carried between runs
+                  (e.g. ARTIST-ALIASES.csv) and do not count as inputs
+        code - local files whose contents are part of the fingerprint (the script itself, country_functions.py, ...)
+        params - extra json values in the fingerprint (e.g. the latest chart week, so the chart pull reruns once a week)
+        env - extra environment variables for shell commands
+    """
+    
+    def __init__(self, name, run, inputs=(), outputs=(), code=(), params=None, env=None):
+        self.name = name
+        self.run = run
+        self.inputs = [key for key in inputs if key not in outputs]
+        self.outputs = list(outputs)
+        self.code = list(code)
+        self.params = params or {}
+        self.env = env or {}
+        
+def file_hash(path):
+    '''
+    GOAL - sha256 of a local file's contents
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(MULTIPART_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def storage_etags(backend, keys):
+    '''
+    GOAL - etag of every key, and of every key under the folders (keys ending in '/'), missing keys map to None
+    INPUTS - 
+        backend - storage backend
+        keys - list of keys / folders
+    OUTPUTS - 
+        etags - dict of key -> etag (sorted by key)
+    '''
+    etags = {}
+    for key in keys:
+        etags.update(backend.etags(key) if key.endswith('/') else {key : backend.etag(key)})
+    return dict(sorted(etags.items()))
+
+def _keys_overlap(a, b):
+    return a == b or (a.endswith('/') and b.startswith(a)) or (b.endswith('/') and a.startswith(b))
+
+class PipelineRunner:
+    """
+    GOAL - run the pipeline stages in dependency order, skipping stages whose inputs, code and params are unchanged since their
+           last successful run (and whose outputs are still as that run left them), independent stages in parallel
+    INPUTS - 
+        stages - list of PipelineStage, dependencies follow from matching one stage's inputs to another's outputs
+        backend - storage backend the stage keys live on (S3 etags are content md5s, so a stage rewriting identical
+                  outputs does not make the next stage rerun)
+        state_key - key of the json state (fingerprint and output etags of each stage's last successful run)
+        max_workers - number of stages run at the same time
+        cwd - folder shell commands run from (default the repo folder, next to the numbered scripts)
+        log_folder (optional) - folder for one stdout/stderr log per shell stage, default inherit the runner's output
+                                (shell stages also get their fingerprint in the PIPELINE_FINGERPRINT environment variable)
+    ATTRIBUTES - 
+        upstream - dict of stage name -> set of names of the stages it depends on
+        state - dict of stage name -> record of its last successful run
+    """
+    
+    def __init__(self, stages, backend, state_key=PIPELINE_STATE_KEY, max_workers=2, cwd=None, log_folder=None):
+        self.stages = {stage.name : stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError('stage names must be unique')
+        self.backend = backend
+        self.state_key = state_key
+        self.max_workers = max_workers
+        self.cwd = cwd if cwd is not None else os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.log_folder = log_folder
+        self.lock = threading.Lock()
+        
+        self.upstream = {name : {other.name for other in stages if other.name != name 
+                                 and any(_keys_overlap(key, output) for key in stage.inputs for output in other.outputs)} 
+                         for name, stage in self.stages.items()}
+        graphlib.TopologicalSorter(self.upstream).prepare() # raises CycleError
+        
+        self.state = {}
+        if backend.exists(state_key):
+            with backend.get_fileobj(state_key) as f:
+                self.state = json.load(f)
+        
+    def fingerprint(self, stage):
+        '''
+        GOAL - sha256 over the stage's input etags, code contents, params and command
+        '''
+        command = stage.run if isinstance(stage.run, (list, tuple)) else stage.run.__module__ + '.' + stage.run.__qualname__
+        content = {'inputs' : storage_etags(self.backend, stage.inputs), 
+                   'code' : {path : file_hash(os.path.join(self.cwd, path)) for path in stage.code}, 
+                   'params' : stage.params, 
+                   'run' : command, 
+                   'env' : stage.env}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def is_current(self, stage, fingerprint):
+        '''
+        GOAL - whether the last successful run of the stage had this fingerprint and its outputs are all still there, unchanged
+        '''
+        record = self.state.get(stage.name)
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+        outputs = storage_etags(self.backend, stage.outputs)
+        missing = None in outputs.values() or not all(any(_keys_overlap(output, key) for key in outputs) for output in stage.outputs)
+        return not missing and outputs == record['outputs']
+        
+    def _save_state(self):
+        self.backend.put_fileobj(io.BytesIO(json.dumps(self.state, indent=1).encode('utf-8')), self.state_key)
+        
+    def _execute(self, stage, fingerprint):
+        if not isinstance(stage.run, (list, tuple)):
+            stage.run()
+            return
+        env = dict(os.environ, **stage.env, **{PIPELINE_FINGERPRINT_ENV : fingerprint})
+        if self.log_folder is None:
+            subprocess.run(stage.run, cwd=self.cwd, env=env, check=True)
+            return
+        os.makedirs(self.log_folder, exist_ok=True)
+        with open(os.path.join(self.log_folder, stage.name + '.log'), 'ab') as log:
+            subprocess.run(stage.run, cwd=self.cwd, env=env, check=True, stdout=log, stderr=subprocess.STDOUT)
+            
+    def _run_stage(self, stage, fingerprint):
+        start = time.perf_counter()
+        self._execute(stage, fingerprint)
+        record = {'fingerprint' : fingerprint, 
+                  'outputs' : storage_etags(self.backend, stage.outputs), 
+                  'finished' : datetime.datetime.now().isoformat(timespec='seconds'), 
+                  'seconds' : time.perf_counter() - start}
+        with self.lock: # saved after every stage, so an interrupted run resumes from the last finished stage
+            self.state[stage.name] = record
+            self._save_state()
+        return record['seconds']
+    
+    def _selected(self, targets):
+        # the targets and everything upstream of them
+        selected, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in selected:
+                selected.add(name)
+                todo.extend(self.upstream[name])
+        return selected
+        
+    def run(self, targets=None, force=(), dry_run=False, report=None):
+        '''
+        GOAL - bring the targets up to date, running each stale stage once all its upstream stages are done
+        INPUTS - 
+            targets - stage names to bring up to date (their upstream stages included), default all
+            force - stage names to rerun even if current
+            dry_run - only report which stages are current ('skipped') and which would run ('stale', stages below a 
+                      stale stage are 'stale' too since their inputs are not known yet)
+            report (optional) - function called with (stage name, status) as stages start and finish, e.g. print
+        OUTPUTS - 
+            results - dataframe with one row per stage: status (skipped, ran, failed, blocked, stale), seconds, error
+        '''
+        report = report or (lambda name, status : None)
+        selected = self._selected(targets if targets is not None else list(self.stages))
+        sorter = graphlib.TopologicalSorter({name : self.upstream[name] & selected for name in selected})
+        sorter.prepare()
+        
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while sorter.is_active():
+                for name in sorter.get_ready():
+                    stage = self.stages[name]
+                    upstream = [results[other]['status'] for other in self.upstream[name] & selected]
+                    if any(status in ('failed', 'blocked') for status in upstream):
+                        results[name] = {'status' : 'blocked', 'seconds' : 0.0, 'error' : None}
+                    elif dry_run and 'stale' in upstream:
+                        results[name] = {'status' : 'stale', 'seconds' : 0.0, 'error' : None}
+                    else:
+                        fingerprint = self.fingerprint(stage)
+                        if name not in force and self.is_current(stage, fingerprint):
+                            results[name] = {'status' : 'skipped', 'seconds' : 0.0, 'error' : None}
+                        elif dry_run:
+                            results[name] = {'status' : 'stale', 'seconds' : 0.0, 'error' : None}
+                        else:
+                            report(name, 'running')
+                            running[executor.submit(self._run_stage, stage, fingerprint)] = name
+                            continue
+                    report(name, results[name]['status'])
+                    sorter.done(name)
+                    
+                if not running:
+                    continue
+                future = next(as_completed(running))
+                name = running.pop(future)
+                try:
+                    results[name] = {'status' : 'ran', 'seconds' : future.result(), 'error' : None}
+                except Exception as e:
+                    results[name] = {'status' : 'failed', 'seconds' : None, 'error' : f'{type(e).__name__}: {e}'}
+                report(name, results[name]['status'])
+                sorter.done(name)
+                
+        return pd.DataFrame.from_dict(results, orient='index').rename_axis('stage')
@@ -0,0 +1,560 @@
+##########
+# Functions to assist with country lyrics project - rnn batching, evaluation, checkpoints and generation
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import json
+import shutil
+import threading
+
+##########
+# SECTION V - RNN TRAINING AND GENERATION
+##########
+
+def get_all_batches(lyrics, batch_size, seq_length, num_batches=None):
+    '''
+    GOAL - stateful-LSTM batches: batch_size parallel streams, each a contiguous stretch of lyrics cut into seq_length windows,
+           returned as strided read-only views of lyrics (no copy, constant memory)
+    INPUTS - 
+        lyrics - 1d array of token ids (e.g. EncodedCorpus.take output, memory maps work too)
+        batch_size - number of parallel streams
+        seq_length - window length
+        num_batches (optional) - number of batches, default the most that fit
+    OUTPUTS - 
+        batches_x, batches_y - arrays of shape (num_batches, batch_size, seq_length), y shifted one token ahead of x
+                               (stream n of batch b starts at token num_batches*seq_length*n + b*seq_length)
+    '''
+    lyrics = np.ascontiguousarray(lyrics)
+    max_batches = (len(lyrics) - 1) // (batch_size * seq_length)
+    num_batches = max_batches if num_batches is None else num_batches
+    if num_batches > max_batches:
+        raise ValueError(f'lyrics only hold {max_batches} batches of {batch_size} x {seq_length}')
+    
+    step = lyrics.strides[0]
+    shape = (num_batches, batch_size, seq_length)
+    strides = (seq_length * step, num_batches * seq_length * step, step)
+    batches_x = np.lib.stride_tricks.as_strided(lyrics, shape=shape, strides=strides, writeable=False)
+    batches_y = np.lib.stride_tricks.as_strided(lyrics[1:], shape=shape, strides=strides, writeable=False)
+    return batches_x, batches_y
+
+def iter_batches(lyrics, batch_size, seq_length, num_batches=None):
+    '''
+    GOAL - generator over the stateful-LSTM batches of get_all_batches (e.g. for tf.data.Dataset.from_generator)
+    OUTPUTS - 
+        generator of (x, y) views of shape (batch_size, seq_length)
+    '''
+    batches_x, batches_y = get_all_batches(lyrics, batch_size, seq_length, num_batches)
+    for x, y in zip(batches_x, batches_y):
+        yield x, y
+
+def get_batch(lyrics, seq_length, batch_size):
+    '''
+    GOAL - batch of windows starting at random offsets (draws the same offsets as the original per-row version)
+    INPUTS - 
+        lyrics - 1d array of token ids
+        seq_length - window length
+        batch_size - number of windows
+    OUTPUTS - 
+        x_batch, y_batch - arrays of shape (batch_size, seq_length), y shifted one token ahead of x
+    '''
+    n = len(lyrics) - 1
+    idx = np.random.choice(n-seq_length, batch_size)
+    
+    windows = np.lib.stride_tricks.sliding_window_view(np.asarray(lyrics), seq_length + 1) # view, no copy
+    batch = windows[idx]
+    return batch[:, :-1], batch[:, 1:]
+
+class StreamingEvaluator:
+    """
+    GOAL - test loss and perplexity of a stateful model over the encoded test stream, weighted by token and broken down by 
+           OHCO keys (decade, gender, ...); the per-batch step is compiled once and sums stay on the device, so it can run 
+           every epoch
+    INPUTS - 
+        model - stateful keras model (batch size taken from model.input_shape)
+        corpus - EncodedCorpus
+        song_rows - test songs in stream order, the same array given to corpus.take
+        seq_length - window length
+        by - song columns to break results down by
+        from_logits - passed to the cross entropy, True matches compute_loss in the notebooks 
+                      (False gives true perplexity for models ending in softmax)
+        reset_states - reset the LSTM states before each evaluation
+    """
+    
+    def __init__(self, model, corpus, song_rows, seq_length, by=('decade', 'gender'), from_logits=True, reset_states=True):
+        import tensorflow as tf
+        self.reset_states = reset_states
+        batch_size = model.input_shape[0]
+        
+        keys = corpus.songs.loc[:, list(by)]
+        codes = keys.groupby(list(by), sort=True, dropna=False).ngroup()
+        first = codes.drop_duplicates().sort_values()
+        self.groups = pd.MultiIndex.from_frame(keys.loc[first.index]) if len(by) > 1 else pd.Index(keys.loc[first.index, by[0]])
+        
+        tokens = corpus.take(song_rows)
+        token_groups = codes.to_numpy()[corpus.song_index(song_rows)].astype(np.int32)
+        self.batches_x, self.batches_y = get_all_batches(tokens, batch_size, seq_length)
+        _, self.batches_groups = get_all_batches(token_groups, batch_size, seq_length) # group of each target token
+        
+        n_groups = len(self.groups)
+        self.from_logits = from_logits
+        self.loss_sums = tf.Variable(tf.zeros(n_groups, tf.float64), trainable=False)
+        self.token_counts = tf.Variable(tf.zeros(n_groups, tf.float64), trainable=False)
+        self._compile(model)
+        
+    def _compile(self, model):
+        # the compiled step captures the model's variables, so it is rebuilt when another model object is evaluated
+        import tensorflow as tf
+        n_groups = len(self.groups)
+        
+        @tf.function
+        def step(x, y, groups):
+            y_hat = model(x, training=False)
+            losses = tf.keras.losses.sparse_categorical_crossentropy(y, y_hat, from_logits=self.from_logits)
+            groups = tf.reshape(groups, [-1])
+            self.loss_sums.assign_add(tf.math.unsorted_segment_sum(tf.cast(tf.reshape(losses, [-1]), tf.float64), groups, n_groups))
+            self.token_counts.assign_add(tf.math.unsorted_segment_sum(tf.ones_like(groups, tf.float64), groups, n_groups))
+        self.model = model
+        self._step = step
+        
+    def __call__(self, model=None):
+        '''
+        GOAL - run the model over every test batch
+        INPUTS - 
+            model (optional) - model to evaluate, e.g. one reloaded with load_model after the evaluator was built 
+                               (same batch size), default the last model evaluated
+        OUTPUTS - 
+            token-weighted mean loss over the whole test stream (same quantity as the old test_loss), the breakdown table 
+            is left in self.results
+        '''
+        if model is not None and model is not self.model:
+            self._compile(model)
+        if self.reset_states:
+            reset_model_states(self.model)
+        self.loss_sums.assign(np.zeros(len(self.groups)))
+        self.token_counts.assign(np.zeros(len(self.groups)))
+        for x, y, groups in zip(self.batches_x, self.batches_y, self.batches_groups):
+            self._step(x, y, groups)
+        
+        loss_sums, token_counts = self.loss_sums.numpy(), self.token_counts.numpy()
+        results = pd.DataFrame({'tokens' : token_counts, 'loss' : loss_sums / np.maximum(token_counts, 1)}, index=self.groups)
+        results = results[results.tokens > 0]
+        results['perplexity'] = np.exp(results.loss)
+        self.results = results
+        return loss_sums.sum() / token_counts.sum()
+    
+    def perplexity(self):
+        return np.exp(self.loss_sums.numpy().sum() / self.token_counts.numpy().sum())
+
+class TrainingCheckpoints:
+    """
+    GOAL - resumable training checkpoints: weights, LSTM states, optimizer slots, numpy RNG (drives get_batch) and the 
+           epoch / batch position. save only copies the variables to host memory, writing the npz and uploading it run on 
+           a background thread, and only the last `keep` checkpoints are kept locally and remotely
+    INPUTS - 
+        model - keras model
+        optimizer - keras optimizer
+        directory - local checkpoint folder
+        keep - number of checkpoints to keep
+        backend (optional) - S3Backend / LocalBackend to mirror the checkpoints to
+        aws_folder (optional) - folder in the backend, holds the checkpoints and a checkpoints.json manifest
+        run (optional) - id of the training run (e.g. the pipeline stage fingerprint), checkpoints saved under another id 
+                         are deleted locally and remotely instead of resumed
+    """
+    
+    def __init__(self, model, optimizer, directory, keep=3, backend=None, aws_folder='', run=None):
+        self.model = model
+        self.optimizer = optimizer
+        self.directory = directory
+        self.keep = keep
+        self.backend = backend
+        self.aws_folder = aws_folder
+        self.writer = ThreadPoolExecutor(max_workers=1) # one thread keeps writes and uploads in save order
+        self.pending = []
+        os.makedirs(directory, exist_ok=True)
+        self.local = sorted(f for f in os.listdir(directory) if f.startswith('ckpt-') and f.endswith('.npz'))
+        self.remote = None # remote manifest, replaced (never mutated) by the writer thread under manifest_lock
+        self.manifest_lock = threading.Lock()
+        self.run = run
+        if run is not None:
+            self._clear_other_runs()
+        
+    def _key(self, file):
+        return (self.aws_folder + '/' if self.aws_folder else '') + file
+    
+    def _load_manifest(self):
+        # call with manifest_lock held
+        if self.remote is None:
+            key = self._key('checkpoints.json')
+            self.remote = json.load(self.backend.get_fileobj(key)) if self.backend.exists(key) else {'checkpoints' : []}
+        return self.remote
+    
+    def _remote_manifest(self):
+        # consistent copy of the remote manifest, safe to read while the writer thread updates it
+        with self.manifest_lock:
+            manifest = self._load_manifest()
+            return dict(manifest, checkpoints=list(manifest['checkpoints']))
+    
+    def _put_manifest(self, manifest):
+        self.backend.put_fileobj(io.BytesIO(json.dumps(manifest).encode('utf-8')), self._key('checkpoints.json'))
+        
+    def _clear_other_runs(self):
+        # checkpoints of another run (e.g. trained on inputs that have changed since) would resume the wrong weights
+        marker = os.path.join(self.directory, 'run.json')
+        local_run = None
+        if os.path.exists(marker):
+            with open(marker, encoding='utf-8') as f:
+                local_run = json.load(f)['run']
+        if local_run != self.run:
+            for name in self.local:
+                os.remove(os.path.join(self.directory, name))
+            self.local = []
+            with open(marker, 'w', encoding='utf-8') as f:
+                json.dump({'run' : self.run}, f)
+                
+        manifest = self._remote_manifest() if self.backend is not None else None
+        if manifest is not None and manifest.get('run') != self.run:
+            for name in manifest['checkpoints']:
+                self.backend.delete(self._key(name))
+            with self.manifest_lock:
+                self.remote = {'run' : self.run, 'checkpoints' : []}
+            self._put_manifest(self.remote)
+    
+    def _optimizer_variables(self):
+        variables = self.optimizer.variables
+        return variables() if callable(variables) else variables # method on keras 2 legacy optimizers
+    
+    def _state_variables(self):
+        return [state for layer in self.model.layers if getattr(layer, 'stateful', False) for state in layer.states]
+        
+    def save(self, epoch, batch):
+        '''
+        GOAL - snapshot the training state, returns as soon as the variables are copied to host memory
+        INPUTS - 
+            epoch - epoch to resume in
+            batch - batch to resume at (i.e. number of batches of this epoch already trained on)
+        OUTPUTS - 
+            name of the checkpoint file
+        '''
+        _, key, pos, has_gauss, cached_gaussian = np.random.get_state()
+        snapshot = {'epoch' : np.array(epoch), 'batch' : np.array(batch), 'np_rng' : np.append(key.astype(np.int64), pos),
+                    'np_gauss' : np.array([has_gauss, cached_gaussian])}
+        snapshot.update({f'weight_{i}' : w for i, w in enumerate(self.model.get_weights())})
+        snapshot.update({f'optimizer_{i}' : np.array(v) for i, v in enumerate(self._optimizer_variables())})
+        snapshot.update({f'state_{i}' : np.array(v) for i, v in enumerate(self._state_variables())})
+        
+        # numbered after the latest local or uploaded checkpoint, so a fresh session never reuses (and then expires) a remote name
+        names = self.local + (self._remote_manifest()['checkpoints'] if self.backend is not None else [])
+        number = max(int(name[5:-4]) for name in names) + 1 if names else 0
+        name = f'ckpt-{number:06d}.npz'
+        self.local.append(name)
+        expired, self.local = self.local[:-self.keep], self.local[-self.keep:]
+        self.pending = [future for future in self.pending if not future.done()]
+        self.pending.append(self.writer.submit(self._write, name, snapshot, expired))
+        return name
+    
+    def _write(self, name, snapshot, expired):
+        path = os.path.join(self.directory, name)
+        with open(path + '.part', 'wb') as f:
+            np.savez(f, **snapshot)
+        os.replace(path + '.part', path) # never leave a half-written checkpoint behind
+        for old in expired:
+            os.remove(os.path.join(self.directory, old))
+            
+        if self.backend is not None:
+            with open(path, 'rb') as f:
+                self.backend.put_fileobj(f, self._key(name))
+            with self.manifest_lock: # save() reads the manifest on the training thread meanwhile
+                manifest = self._load_manifest()
+                checkpoints = manifest['checkpoints'] + [name]
+                expired = checkpoints[:-self.keep]
+                self.remote = manifest = dict(manifest, checkpoints=checkpoints[-self.keep:])
+            self._put_manifest(manifest) # puts stay in save order, there is a single writer thread
+            for old in expired:
+                self.backend.delete(self._key(old))
+        
+    def restore(self):
+        '''
+        GOAL - resume from the latest local checkpoint, or the latest uploaded one if the local folder is empty 
+               (e.g. a fresh colab session)
+        OUTPUTS - 
+            epoch, batch - position to resume at, (0, 0) if there is no checkpoint
+        '''
+        remote = self._remote_manifest()['checkpoints'] if not self.local and self.backend is not None else []
+        if remote:
+            name = remote[-1]
+            path = os.path.join(self.directory, name)
+            with open(path + '.part', 'wb') as f:
+                shutil.copyfileobj(self.backend.get_fileobj(self._key(name)), f)
+            os.replace(path + '.part', path) # an interrupted download never leaves a truncated checkpoint to resume from
+            self.local = [name]
+        if not self.local:
+            return 0, 0
+        
+        with np.load(os.path.join(self.directory, self.local[-1])) as saved:
+            self.model.set_weights([saved[f'weight_{i}'] for i in range(len(self.model.get_weights()))])
+            if not self._optimizer_variables() or not getattr(self.optimizer, 'built', True):
+                self.optimizer.build(self.model.trainable_variables)
+            for i, v in enumerate(self._optimizer_variables()):
+                v.assign(saved[f'optimizer_{i}'])
+            for i, v in enumerate(self._state_variables()):
+                v.assign(saved[f'state_{i}'])
+            rng, (has_gauss, cached_gaussian) = saved['np_rng'], saved['np_gauss']
+            np.random.set_state(('MT19937', rng[:624].astype(np.uint32), int(rng[624]), int(has_gauss), float(cached_gaussian)))
+            return int(saved['epoch']), int(saved['batch'])
+    
+    def close(self):
+        '''
+        GOAL - wait for pending writes and uploads (raises if one of them failed)
+        '''
+        for future in self.pending:
+            future.result()
+        self.pending = []
+
+class LossLog:
+    """
+    GOAL - training loss history off the hot path: losses stay on the device and are pulled to the host in one transfer 
+           (and the plot redrawn) every `every` steps instead of after each one
+    INPUTS - 
+        every - steps between flushes
+        plotter (optional) - object with a plot(history) method (e.g. mitdeeplearning's PeriodicPlotter)
+    """
+    
+    def __init__(self, every=100, plotter=None):
+        self.every = every
+        self.plotter = plotter
+        self.pending = []
+        self.history = []
+        
+    def append(self, loss):
+        self.pending.append(loss)
+        if len(self.pending) >= self.every:
+            self.flush()
+            
+    def flush(self):
+        import tensorflow as tf
+        if self.pending:
+            losses = tf.stack([tf.reshape(loss, [-1]) for loss in self.pending]).numpy()
+            self.pending = []
+            self.history.extend(losses.mean(axis=1).tolist())
+            if self.plotter is not None:
+                self.plotter.plot(self.history)
+        return self.history
+
+def temperature_processor(temperature):
+    '''
+    GOAL - logit processor scaling log-probabilities by 1/temperature (< 1 sharper, > 1 flatter)
+    '''
+    return lambda logits : logits / temperature
+
+def top_k_processor(k):
+    '''
+    GOAL - logit processor keeping only the k most likely tokens of every row
+    '''
+    import tensorflow as tf
+    
+    def keep_top_k(logits):
+        kth = tf.math.top_k(logits, k=k).values[:, -1:]
+        return tf.where(logits < kth, tf.fill(tf.shape(logits), float('-inf')), logits)
+    return keep_top_k
+
+def topic_processor(topic_weights):
+    '''
+    GOAL - logit processor steering generation towards a topic, same as sampling from topic_weights * predictions
+    INPUTS - 
+        topic_weights - tensor of shape [1, vocab] (same weights for every song) or [n_songs, vocab] (one row per song)
+    '''
+    import tensorflow as tf
+    log_weights = tf.math.log(tf.cast(topic_weights, tf.float32))
+    return lambda logits : logits + log_weights
+
+def reset_model_states(model):
+    # keras 2 models reset every stateful layer with reset_states, keras 3 only has it on the layers
+    if hasattr(model, 'reset_states'):
+        model.reset_states()
+    else:
+        for layer in model.layers:
+            if getattr(layer, 'stateful', False):
+                layer.reset_states()
+
+def generate_songs(model, start_string, tokenizer, generation_length=1000, logit_processors=(), token_mapper=None, 
+                   stop_token=None, markers=('<l>', '<s>', '<e>')):
+    '''
+    GOAL - generate one song per row of a stateful model's batch in parallel, one compiled model call per step for all songs
+           (replaces generate_text_simple / _topic / _embeddings / _topics_embeddings)
+    INPUTS - 
+        model - stateful lstm model built with batch_size = number of songs to generate, returning softmax predictions
+        start_string - first word of every song
+        tokenizer - fitted keras tokenizer or EncodedCorpus (1-based word_index / index_word, model ids are shifted down by one)
+        generation_length - maximum number of generated tokens per song
+        logit_processors - list of functions logits -> logits applied in order before sampling 
+                           (topic_processor, temperature_processor, top_k_processor)
+        token_mapper (optional) - function word -> word applied to generated non-marker words (e.g. embedding substitution)
+        stop_token (optional) - stop a song at this token (e.g. '<e>'), generation ends when every song has stopped
+        markers - words left untouched by token_mapper
+    OUTPUTS - 
+        songs - list of generated strings, one per batch row
+    '''
+    import tensorflow as tf
+    
+    n_songs = model.input_shape[0]
+    vocab = np.array([tokenizer.index_word.get(i + 1, '') for i in range(max(tokenizer.index_word) + 1)], dtype=object)
+    stop_id = tokenizer.word_index[stop_token] - 1 if stop_token is not None else None
+    
+    @tf.function
+    def step(input_ids):
+        predictions = model(input_ids, training=False)[:, -1, :]
+        logits = tf.math.log(predictions)
+        for processor in logit_processors:
+            logits = processor(logits)
+        return tf.random.categorical(logits, num_samples=1, dtype=tf.int32)
+    
+    reset_model_states(model)
+    input_ids = tf.fill([n_songs, 1], tf.constant(tokenizer.word_index[start_string] - 1, dtype=tf.int32))
+    generated = []
+    for i in range(generation_length):
+        input_ids = step(input_ids)
+        generated.append(input_ids)
+        if stop_id is not None and i % 32 == 31 and (tf.concat(generated, axis=1).numpy() == stop_id).any(axis=1).all():
+            break
+    generated = tf.concat(generated, axis=1).numpy()
+    
+    songs = []
+    for row in generated:
+        if stop_id is not None and (row == stop_id).any():
+            row = row[:np.argmax(row == stop_id) + 1]
+        words = vocab[row]
+        if token_mapper is not None:
+            words = [word if word in markers else token_mapper(word) for word in words]
+        songs.append(start_string + ' ' + ' '.join(words))
+    return songs
+
+class EmbeddingNeighbours:
+    """
+    GOAL - precomputed glove neighbour table for the model vocab, replacing similar_word's multivariate normal draw and
+           full-vocabulary similar_by_vector scan: a word is perturbed with isotropic noise and mapped to the closest of its
+           k cached nearest neighbours (itself included)
+    INPUTS - 
+        keyed_vectors - gensim embeddings object (KeyedVectors), not needed when loading a saved table
+        vocab - iterable of model vocab words, words missing from the embeddings are returned unchanged
+        k - number of cached neighbours per word
+        variance - noise variance per dimension (similar_word used cov = 0.2 * I)
+        seed (optional) - seed of the noise generator
+        chunk_size - number of vocab words per matrix product against the full embedding matrix
+    """
+    
+    def __init__(self, keyed_vectors, vocab, k=100, variance=2e-1, seed=None, chunk_size=32, table=None):
+        self.std = np.sqrt(variance)
+        self.rng = np.random.default_rng(seed)
+        if table is None:
+            table = self._build(keyed_vectors, vocab, k, chunk_size)
+        self.words, self.vectors, self.neighbour_words, self.neighbour_vectors = table
+        self.word_row = {word : i for i, word in enumerate(self.words)}
+        
+    @staticmethod
+    def _build(keyed_vectors, vocab, k, chunk_size):
+        normed = keyed_vectors.get_normed_vectors()
+        words = [word for word in dict.fromkeys(vocab) if word in keyed_vectors.key_to_index]
+        rows = np.array([keyed_vectors.key_to_index[word] for word in words], dtype=np.int64)
+        
+        neighbours = np.empty((len(words), k), dtype=np.int64)
+        for start in range(0, len(words), chunk_size):
+            sims = normed[rows[start:start+chunk_size]] @ normed.T
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+            neighbours[start:start+chunk_size] = np.take_along_axis(top, order, axis=1)
+            
+        return (np.array(words, dtype=object), keyed_vectors.vectors[rows], 
+                np.array(keyed_vectors.index_to_key, dtype=object)[neighbours], normed[neighbours])
+    
+    def __call__(self, word):
+        '''
+        GOAL - similar_word for one word: closest cached neighbour of a noisy draw around the word's vector
+        '''
+        row = self.word_row.get(word)
+        if row is None:
+            return word
+        draw = self.vectors[row] + self.std * self.rng.standard_normal(self.vectors.shape[1])
+        return self.neighbour_words[row, np.argmax(self.neighbour_vectors[row] @ draw)]
+    
+    def save(self, path):
+        '''
+        GOAL - save the table (a few MB) so generation sessions do not need to load the full embeddings
+        '''
+        np.savez(path, words=self.words.astype(str), vectors=self.vectors, 
+                 neighbour_words=self.neighbour_words.astype(str), neighbour_vectors=self.neighbour_vectors)
+        
+    @classmethod
+    def load(cls, path, variance=2e-1, seed=None):
+        saved = np.load(path)
+        table = (saved['words'].astype(object), saved['vectors'], saved['neighbour_words'].astype(object), saved['neighbour_vectors'])
+        return cls(None, None, variance=variance, seed=seed, table=table)
+
+class TopicWeightBank:
+    """
+    GOAL - every topic's generation weights built once: sqrt of the topic-term probabilities as a [n_topics x vocab]
+           array aligned to the tokenizer's index_word order, so a topic (or a mix of topics) for every song of a generation 
+           batch is one matrix product
+    INPUTS - 
+        topic_model_df - topic-term probabilities with topics as rows and terms as columns (rnn-topic-probs.csv transposed)
+        index_word - tokenizer.index_word (or EncodedCorpus.index_word), defines the column order
+        topic_dict - dict of topic name -> topic id (row label in topic_model_df)
+    """
+    
+    def __init__(self, topic_model_df, index_word, topic_dict, bank=None, topic_ids=None):
+        self.topic_dict = {name : str(topic_id) for name, topic_id in topic_dict.items()}
+        if bank is None:
+            word_order = [v for k, v in sorted(index_word.items())]
+            probs = topic_model_df.T.loc[word_order] # raises on words missing from the topic model
+            probs.columns = probs.columns.astype(str)
+            bank = np.sqrt(probs.to_numpy(dtype=np.float32).T) # sqrt tones down the topic model while still wielding influence
+            topic_ids = list(probs.columns)
+        self.bank = bank
+        self.topic_ids = list(topic_ids)
+        self.topic_row = {topic_id : i for i, topic_id in enumerate(self.topic_ids)}
+        
+    def mixture(self, topics):
+        '''
+        GOAL - [n_rows x n_topics] mixing matrix for a list of topic specs
+        INPUTS - 
+            topics - one spec or a list of specs, one per batch row; a spec is a topic name, or a dict of topic name -> weight 
+                     (weights are normalized to sum to one)
+        '''
+        topics = [topics] if isinstance(topics, (str, dict)) else list(topics)
+        mixture = np.zeros((len(topics), len(self.topic_ids)), dtype=np.float32)
+        for row, spec in enumerate(topics):
+            spec = {spec : 1.0} if isinstance(spec, str) else spec
+            total = sum(spec.values())
+            for name, weight in spec.items():
+                mixture[row, self.topic_row[self.topic_dict[name]]] += weight / total
+        return mixture
+        
+    def weights(self, topics):
+        '''
+        GOAL - topic weights tensor for topic_processor, [1 x vocab] for one topic or 
+               [n_rows x vocab] for one spec per batch row
+        INPUTS - 
+            topics - see mixture
+        '''
+        import tensorflow as tf
+        return tf.constant(self.mixture(topics) @ self.bank)
+    
+    def save(self, path):
+        '''
+        GOAL - store the bank next to the model so generation sessions skip the topic-probability csv
+        '''
+        np.savez(path, bank=self.bank, topic_ids=np.array(self.topic_ids), 
+                 names=np.array(list(self.topic_dict)), name_ids=np.array(list(self.topic_dict.values())))
+        
+    @classmethod
+    def load(cls, path):
+        saved = np.load(path)
+        return cls(None, None, dict(zip(saved['names'], saved['name_ids'])), bank=saved['bank'], topic_ids=saved['topic_ids'])
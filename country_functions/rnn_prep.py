@@ -0,0 +1,362 @@
+##########
+# Functions to assist with country lyrics project - rnn vocab reduction, encoded corpus and document-term matrix
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import pandas as pd
+import numpy as np
+import os
+from scipy import sparse
+
+from .run_report import instrumented
+
+##########
+# SECTION IV - PROCESSING CORPUS (RNN)
+##########
+    
+def reduce(word, vocab):
+    '''
+    GOAL - determine whether a token is in or out of vocab (used for RNN vocab reduction)
+    INPUTS - 
+        word - string
+        vocab - list of strings (words that make up the vocab)
+    OUTPUTS - 
+        same word if in vocab, word 'replace'
+    '''  
+    if word in vocab:
+        return word
+    else:
+        return 'replace'
+    
+def replace_with_similar(word, embeddings, vocab):
+    '''
+    GOAL - replace an out-of-vocab word with the closest in-vocab word in the glove word embedding space, or with 'no match' if no in-vocab words in top 100
+    INPUTS - 
+        word - string
+        embeddings - gensim embeddings object
+        vocab - list of strings (words that make up the vocab)
+    OUTPUTS - 
+        either closest in-vocab word or 'no match' (if no close in-vocab matches)
+    ''' 
+    if word in vocab:
+        return word
+    else:
+        try:
+            return [x[0] for x in embeddings.most_similar(word, topn=100) if x[0] in vocab][0]
+        except:
+            return 'no match'
+
+
+def reduce_tokens(tokens : pd.Series, vocab):
+    '''
+    GOAL - series version of reduce, a single hashed membership test instead of a list scan per token
+    INPUTS - 
+        tokens - series of strings
+        vocab - list of strings (words that make up the vocab)
+    OUTPUTS - 
+        series with out-of-vocab tokens replaced by 'replace'
+    '''
+    return tokens.where(tokens.isin(set(vocab)), 'replace')
+
+def similar_in_vocab(words, embeddings, vocab, topn=100, chunk_size=32):
+    '''
+    GOAL - replace_with_similar for a set of out-of-vocab words at once: cosine similarities to the in-vocab embedding rows
+           in one matrix product per chunk of words, plus a check that the best in-vocab word is within the word's topn neighbours
+    INPUTS - 
+        words - iterable of out-of-vocab strings
+        embeddings - gensim embeddings object (KeyedVectors)
+        vocab - list of strings (words that make up the vocab)
+        topn - an in-vocab word only counts if it is among the topn nearest words overall (as in replace_with_similar),
+               None to always take the nearest in-vocab word (skips the scan over the full embedding vocabulary)
+        chunk_size - number of words per matrix product against the full embedding vocabulary
+    OUTPUTS - 
+        replacements - dict of word -> closest in-vocab word or 'no match'
+    '''
+    normed = embeddings.get_normed_vectors()
+    key_to_index = embeddings.key_to_index
+    
+    vocab_keys = [word for word in dict.fromkeys(vocab) if word in key_to_index]
+    vocab_normed = normed[[key_to_index[word] for word in vocab_keys]]
+    
+    replacements = {}
+    words = [word for word in dict.fromkeys(words)]
+    for word in words:
+        if word not in key_to_index or not vocab_keys:
+            replacements[word] = 'no match'
+    found = [word for word in words if word not in replacements]
+    
+    for start in range(0, len(found), chunk_size):
+        chunk = found[start:start+chunk_size]
+        chunk_normed = normed[[key_to_index[word] for word in chunk]]
+        
+        vocab_sims = chunk_normed @ vocab_normed.T
+        best = vocab_sims.argmax(axis=1)
+        best_sims = vocab_sims[np.arange(len(chunk)), best]
+        
+        if topn is None:
+            within_topn = np.ones(len(chunk), dtype=bool)
+        else:
+            # rank of the best in-vocab word among all words, not counting the word itself (most_similar leaves it out)
+            all_sims = chunk_normed @ normed.T
+            self_sims = all_sims[np.arange(len(chunk)), [key_to_index[word] for word in chunk]]
+            rank = (all_sims > best_sims[:, None]).sum(axis=1) - (self_sims > best_sims)
+            within_topn = rank < topn
+            
+        for word, i, ok in zip(chunk, best, within_topn):
+            replacements[word] = vocab_keys[i] if ok else 'no match'
+            
+    return replacements
+
+def replace_with_similar_tokens(tokens : pd.Series, embeddings, vocab, topn=100, replacements=None):
+    '''
+    GOAL - series version of replace_with_similar, looking up each distinct out-of-vocab word once (see similar_in_vocab)
+    INPUTS - 
+        tokens - series of strings
+        embeddings - gensim embeddings object (KeyedVectors)
+        vocab - list of strings (words that make up the vocab)
+        topn - see similar_in_vocab
+        replacements (optional) - dict of word -> replacement reused and filled across calls
+    OUTPUTS - 
+        series with out-of-vocab tokens replaced by their closest in-vocab word or 'no match'
+    '''
+    replacements = replacements if replacements is not None else {}
+    in_vocab = tokens.isin(set(vocab))
+    
+    oov = [word for word in tokens[~in_vocab].unique() if word not in replacements]
+    replacements.update(similar_in_vocab(oov, embeddings, vocab, topn=topn))
+    
+    return tokens.where(in_vocab, tokens.map(replacements))
+
+@instrumented
+def encode_corpus(tokens : pd.DataFrame, OHCO, folder, col_name='token', backend=None, aws_folder=None):
+    '''
+    GOAL - persist a token table as an integer-encoded corpus: vocab.txt (one word per line, id = line number), 
+           tokens.npy (int32 ids of all songs back to back, memory-mappable) and songs.csv (OHCO keys plus start/end offsets)
+    INPUTS - 
+        tokens - token table with OHCO columns (e.g. TOKENS-RNN), in reading order within each song
+        OHCO - list of OHCO names, songs are keyed on OHCO[:5]
+        folder - local folder to write the three files to
+        col_name - name of the token column
+        backend, aws_folder (optional) - also upload the three files to aws_folder on this storage backend
+    OUTPUTS - 
+        corpus - EncodedCorpus loaded from folder
+    '''
+    song_keys = OHCO[:5]
+    tokens = tokens.sort_values(song_keys, kind='stable') # songs contiguous (and decades contiguous) in the token array
+    words = tokens[col_name].astype(str)
+    
+    # vocab ordered like the keras tokenizer: by descending count, ties by first appearance
+    codes, uniques = pd.factorize(words)
+    counts = np.bincount(codes, minlength=len(uniques))
+    order = np.argsort(-counts, kind='stable')
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    
+    # dropna=False keeps songs with a NaN key (gender is only tagged for top artists), their tokens are in the array too
+    songs = tokens.groupby(song_keys, sort=False, dropna=False).size().to_frame('length').reset_index()
+    songs['end'] = songs['length'].cumsum()
+    songs['start'] = songs['end'] - songs['length']
+    assert songs['end'].iloc[-1] == len(tokens), 'song offsets do not cover the token array'
+    
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'vocab.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(uniques[order]) + '\n')
+    np.save(os.path.join(folder, 'tokens.npy'), remap[codes].astype(np.int32))
+    songs[song_keys + ['start', 'end']].to_csv(os.path.join(folder, 'songs.csv'), index=False)
+    
+    if backend is not None:
+        for filename in ['vocab.txt', 'tokens.npy', 'songs.csv']:
+            with open(os.path.join(folder, filename), 'rb') as f:
+                backend.put_fileobj(f, aws_folder + '/' + filename)
+    
+    return EncodedCorpus(folder)
+
+class EncodedCorpus:
+    """
+    GOAL - integer-encoded corpus written by encode_corpus, the token array is memory-mapped so loading is nearly free
+    INPUTS - 
+        folder - local folder holding vocab.txt, tokens.npy and songs.csv
+        mmap - memory-map the token array instead of reading it into RAM
+    ATTRIBUTES - 
+        vocab - list of words, position = token id
+        word2idx, idx2word - dicts between words and 0-based token ids
+        word_index, index_word - 1-based versions, drop-in for a fitted keras Tokenizer (as used by the generation functions)
+        tokens - int32 array of all token ids
+        songs - dataframe of OHCO keys with start/end offsets into tokens
+    """
+    
+    def __init__(self, folder, mmap=True):
+        with open(os.path.join(folder, 'vocab.txt'), encoding='utf-8') as f:
+            self.vocab = f.read().split('\n')[:-1]
+        self.word2idx = {word : i for i, word in enumerate(self.vocab)}
+        self.idx2word = dict(enumerate(self.vocab))
+        self.word_index = {word : i + 1 for i, word in enumerate(self.vocab)}
+        self.index_word = {i + 1 : word for i, word in enumerate(self.vocab)}
+        self.tokens = np.load(os.path.join(folder, 'tokens.npy'), mmap_mode='r' if mmap else None)
+        self.songs = pd.read_csv(os.path.join(folder, 'songs.csv'))
+        
+    def song_range(self, mask):
+        '''
+        GOAL - zero-copy view of the tokens of a contiguous block of songs (e.g. one decade, since songs are sorted by OHCO)
+        INPUTS - 
+            mask - boolean series/array over songs, selected songs must be contiguous
+        OUTPUTS - 
+            view of the token array
+        '''
+        selected = np.flatnonzero(np.asarray(mask))
+        if not len(selected):
+            return self.tokens[:0]
+        if selected[-1] - selected[0] + 1 != len(selected):
+            raise ValueError('selected songs are not contiguous, use take')
+        return self.tokens[self.songs.start.iloc[selected[0]]:self.songs.end.iloc[selected[-1]]]
+        
+    def take(self, song_rows):
+        '''
+        GOAL - token ids of the given songs, back to back in the given order (e.g. a shuffled train split)
+        INPUTS - 
+            song_rows - positions or boolean mask of songs in self.songs
+        OUTPUTS - 
+            int32 array
+        '''
+        song_rows = np.asarray(song_rows)
+        if song_rows.dtype == bool:
+            song_rows = np.flatnonzero(song_rows)
+        starts = self.songs.start.to_numpy()[song_rows]
+        lens = self.songs.end.to_numpy()[song_rows] - starts
+        index = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(lens.sum())
+        return np.asarray(self.tokens[index])
+    
+    def song_index(self, song_rows):
+        '''
+        GOAL - position in self.songs of the song each token of take(song_rows) belongs to, lined up with the take output
+        INPUTS - 
+            song_rows - positions or boolean mask of songs in self.songs (same as given to take)
+        OUTPUTS - 
+            int64 array
+        '''
+        song_rows = np.asarray(song_rows)
+        if song_rows.dtype == bool:
+            song_rows = np.flatnonzero(song_rows)
+        lens = self.songs.end.to_numpy()[song_rows] - self.songs.start.to_numpy()[song_rows]
+        return np.repeat(song_rows.astype(np.int64), lens)
+    
+    def decode(self, ids):
+        return ' '.join(self.vocab[i] for i in ids)
+
+class DocumentTermMatrix:
+    """
+    GOAL - sparse song x term count matrix (CSR) built straight from the integer-encoded token stream, in place of the 
+           BOW groupby + dense pivot; memory is proportional to the nonzero counts rather than songs x vocab
+    INPUTS - 
+        terms - list of terms, position = column
+        X (optional) - csr matrix of counts, songs x terms
+        songs (optional) - dataframe of song keys (OHCO[:5]), one row per matrix row
+    """
+    
+    def __init__(self, terms, X=None, songs=None, song_keys=('decade', 'year', 'gender', 'artist_strip', 'title')):
+        self.terms = list(terms)
+        self.term_index = {term : i for i, term in enumerate(self.terms)}
+        self.song_keys = list(song_keys)
+        self.X = X if X is not None else sparse.csr_matrix((0, len(self.terms)), dtype=np.int32)
+        self.songs = songs if songs is not None else pd.DataFrame(columns=self.song_keys)
+        
+    @classmethod
+    def from_corpus(cls, corpus, song_rows=None, chunk_tokens=1000000):
+        '''
+        GOAL - count matrix for the songs of an EncodedCorpus
+        INPUTS - 
+            corpus - EncodedCorpus
+            song_rows (optional) - positions or boolean mask of songs to include, default all
+            chunk_tokens - approximate number of tokens counted at once (bounds the temporary arrays)
+        '''
+        dtm = cls(corpus.vocab, song_keys=[c for c in corpus.songs.columns if c not in ('start', 'end')])
+        dtm.add(corpus, song_rows, chunk_tokens)
+        return dtm
+    
+    def _count(self, corpus, song_rows, chunk_tokens):
+        # corpus token id -> column, new words get new columns at the end
+        columns = np.array([self.term_index.setdefault(word, len(self.term_index)) for word in corpus.vocab], dtype=np.int64)
+        self.terms = list(self.term_index)
+        
+        lens = (corpus.songs.end.to_numpy() - corpus.songs.start.to_numpy())[song_rows]
+        chunk_ends = np.searchsorted(np.cumsum(lens), np.arange(chunk_tokens, lens.sum() + chunk_tokens, chunk_tokens), side='right')
+        blocks, first = [], 0
+        for last in np.unique(np.append(chunk_ends, len(song_rows))):
+            if last <= first:
+                continue
+            rows = song_rows[first:last]
+            cols = columns[corpus.take(rows)]
+            row_ids = np.repeat(np.arange(len(rows)), lens[first:last])
+            block = sparse.csr_matrix((np.ones(len(cols), dtype=np.int32), (row_ids, cols)), shape=(len(rows), len(self.terms)))
+            block.sum_duplicates()
+            blocks.append(block)
+            first = last
+        return blocks
+        
+    def add(self, corpus, song_rows=None, chunk_tokens=1000000):
+        '''
+        GOAL - incremental update: append rows for songs of corpus not yet in the matrix (matched on the song keys); 
+               a re-encoded corpus with a different or larger vocab is fine, columns are matched by word
+        INPUTS - 
+            corpus - EncodedCorpus
+            song_rows (optional) - positions or boolean mask of candidate songs, default all
+            chunk_tokens - approximate number of tokens counted at once
+        OUTPUTS - 
+            number of songs added
+        '''
+        song_rows = np.arange(len(corpus.songs)) if song_rows is None else np.asarray(song_rows)
+        if song_rows.dtype == bool:
+            song_rows = np.flatnonzero(song_rows)
+        if len(self.songs):
+            known = pd.MultiIndex.from_frame(self.songs[self.song_keys].astype(str))
+            candidates = pd.MultiIndex.from_frame(corpus.songs[self.song_keys].iloc[song_rows].astype(str))
+            song_rows = song_rows[~candidates.isin(known)]
+        if not len(song_rows):
+            return 0
+        
+        blocks = self._count(corpus, song_rows, chunk_tokens)
+        X = self.X
+        if X.shape[1] < len(self.terms): # vocab grew
+            X = sparse.csr_matrix((X.data, X.indices, X.indptr), shape=(X.shape[0], len(self.terms)))
+        blocks = [sparse.csr_matrix((b.data, b.indices, b.indptr), shape=(b.shape[0], len(self.terms))) for b in blocks]
+        self.X = sparse.vstack([X] + blocks, format='csr')
+        new_songs = corpus.songs[self.song_keys].iloc[song_rows]
+        self.songs = pd.concat([self.songs, new_songs], ignore_index=True) if len(self.songs) else new_songs.reset_index(drop=True)
+        return len(song_rows)
+    
+    def to_frame(self):
+        '''
+        GOAL - sparse-backed dataframe (songs x terms, indexed by the song keys) for topic models expecting a dataframe X
+        '''
+        X = pd.DataFrame.sparse.from_spmatrix(self.X, index=pd.MultiIndex.from_frame(self.songs), columns=self.terms)
+        X.columns.name = 'term_str'
+        return X
+    
+    def to_bow(self):
+        '''
+        GOAL - long BOW table (song keys + token -> n), the same table as the old groupby-count BOW_RNN, so it can go through 
+               TopicModel's own constructor and create_X (memory proportional to the nonzero counts, like the matrix)
+        '''
+        X = self.X.tocoo()
+        bow = self.songs.iloc[X.row].reset_index(drop=True)
+        bow['token'] = np.array(self.terms, dtype=object)[X.col]
+        bow['n'] = X.data
+        return bow.set_index(self.song_keys + ['token']).sort_index() # groupby order
+    
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        sparse.save_npz(os.path.join(folder, 'dtm.npz'), self.X)
+        self.songs.to_csv(os.path.join(folder, 'dtm-songs.csv'), index=False)
+        with open(os.path.join(folder, 'dtm-terms.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(self.terms) + '\n')
+    
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, 'dtm-terms.txt'), encoding='utf-8') as f:
+            terms = f.read().split('\n')[:-1]
+        songs = pd.read_csv(os.path.join(folder, 'dtm-songs.csv'))
+        return cls(terms, sparse.load_npz(os.path.join(folder, 'dtm.npz')).tocsr(), songs, song_keys=songs.columns)
@@ -0,0 +1,213 @@
+##########
+# Functions to assist with country lyrics project - run instrumentation (stage timings, io, peak memory)
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import io
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+import functools
+import atexit
+
+try:
+    import resource # unix only, used for peak memory in run reports
+except ImportError:
+    resource = None
+
+##########
+# RUN INSTRUMENTATION
+##########
+
+class Instrumentation:
+    """
+    GOAL - per-stage wall time, call counts, rows in / out, bytes moved and peak RSS for the country_functions entry points 
+           decorated with @instrumented; off by default, when a decorated call costs a single attribute check
+    ATTRIBUTES - 
+        enabled - whether calls are recorded
+        stages - dict of stage name -> counters (times are inclusive, e.g. csv_to_s3 includes its S3 put)
+        stage_peaks - whether peak_rss_mb is the peak while the stage ran (linux, the high-water mark is reset when a stage 
+                      starts) or only the process peak at stage exit (elsewhere)
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.started = None
+        self.stage_peaks = False
+        self.process_peak = None
+        self.open_peaks = {} # open stage call -> peak seen so far
+        self.next_call = 0
+        
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+        self.stages = {}
+        self.stage_peaks = _reset_peak_rss()
+        self.process_peak = None
+        self.open_peaks = {}
+        
+    def disable(self):
+        self.enabled = False
+        
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {'calls' : 0, 'errors' : 0, 'wall_s' : 0.0, 'rows_in' : 0, 'rows_out' : 0, 'bytes' : 0, 
+                                  'peak_rss_mb' : None}
+        return self.stages[stage]
+        
+    def _fold_peak(self):
+        # the high-water mark since the last reset happened while every open stage ran, credit it to all of them
+        peak = _peak_rss_mb(self.stage_peaks)
+        if peak is None:
+            return
+        self.process_peak = max(self.process_peak or 0, peak)
+        for call, open_peak in self.open_peaks.items():
+            self.open_peaks[call] = max(open_peak or 0, peak)
+    
+    def start(self):
+        '''
+        GOAL - open a stage call for peak memory, returns the id to pass to record
+        '''
+        with self.lock:
+            self._fold_peak()
+            if self.stage_peaks:
+                _reset_peak_rss() # stages opened earlier keep what they have seen so far
+            self.next_call += 1
+            self.open_peaks[self.next_call] = None
+            return self.next_call
+        
+    def record(self, stage, wall_s, rows_in=0, rows_out=0, error=False, call=None):
+        with self.lock:
+            self._fold_peak()
+            peak_rss = self.open_peaks.pop(call, None) if call is not None else _peak_rss_mb(self.stage_peaks)
+            counters = self._stage(stage)
+            counters['calls'] += 1
+            counters['errors'] += int(error)
+            counters['wall_s'] += wall_s
+            counters['rows_in'] += rows_in
+            counters['rows_out'] += rows_out
+            if peak_rss is not None: # highest over the stage's calls
+                counters['peak_rss_mb'] = max(counters['peak_rss_mb'] or 0, peak_rss)
+            
+    def add_bytes(self, stage, n_bytes):
+        if self.enabled:
+            with self.lock:
+                self._stage(stage)['bytes'] += n_bytes
+    
+    def report(self):
+        '''
+        GOAL - machine-readable run report (json-serializable dict)
+        '''
+        with self.lock:
+            self._fold_peak()
+            return {'started' : datetime.datetime.fromtimestamp(self.started).isoformat() if self.started else None,
+                    'wall_s' : time.time() - self.started if self.started else None,
+                    'peak_rss_mb' : self.process_peak,
+                    'stage_peak_rss' : 'peak while the stage ran' if self.stage_peaks else 'process peak at stage exit',
+                    'stages' : {stage : dict(counters) for stage, counters in 
+                                sorted(self.stages.items(), key=lambda item : -item[1]['wall_s'])}}
+    
+    def write_report(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+instrumentation = Instrumentation()
+
+def _peak_rss_mb(resettable=False):
+    # VmHWM from /proc when stage peaks are on (the mark _reset_peak_rss clears), else the process-wide ru_maxrss
+    if resettable:
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024 # bytes on macos, kilobytes on linux
+
+def _reset_peak_rss():
+    # clear the peak rss high-water mark (linux 4.0+), False where that is not possible
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _is_table(obj):
+    # pandas is only looked up, never imported here: if no module has imported it, obj cannot be a dataframe
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(obj, (pd.DataFrame, pd.Series))
+
+def _n_rows(obj):
+    return len(obj) if _is_table(obj) else 0
+
+def instrumented(func):
+    '''
+    GOAL - decorator recording calls of func in the run report under its (qualified) name, rows in = length of the first 
+           dataframe / series argument, rows out = length of a dataframe / series result
+    '''
+    stage = func.__qualname__
+    
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not instrumentation.enabled:
+            return func(*args, **kwargs)
+        rows_in = next((_n_rows(arg) for arg in args if _is_table(arg)), 0)
+        call = instrumentation.start()
+        start = time.perf_counter()
+        result, error = None, True
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            instrumentation.record(stage, time.perf_counter() - start, rows_in, _n_rows(result), error, call)
+    return wrapper
+
+class _CountingReader(io.RawIOBase):
+    # read-through wrapper adding the bytes read to a stage of the run report
+    def __init__(self, fileobj, stage):
+        self.fileobj = fileobj
+        self.stage = stage
+    def readable(self):
+        return True
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        instrumentation.add_bytes(self.stage, len(data))
+        return data
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+RUN_REPORT_ENV = 'COUNTRY_RUN_REPORT'
+
+def start_run_report(path, env_var=RUN_REPORT_ENV):
+    '''
+    GOAL - if the env_var environment variable is set (e.g. COUNTRY_RUN_REPORT=1 python 1-pull-charts.py), turn on 
+           instrumentation for this run and write the json report to path when the process exits (also on errors)
+    INPUTS - 
+        path - report file, e.g. ../data/run-reports/1-pull-charts.json
+        env_var - environment variable switching the report on, unset / empty / 0 leaves instrumentation off
+    OUTPUTS - 
+        whether the report is on
+    '''
+    if os.getenv(env_var, '') in ('', '0'):
+        return False
+    instrumentation.enable()
+    atexit.register(instrumentation.write_report, path)
+    return True
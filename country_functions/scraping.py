@@ -0,0 +1,598 @@
+##########
+# Functions to assist with country lyrics project - billboard chart pulls, chart tables and genius lyrics
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import pandas as pd
+import numpy as np
+import datetime
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+import json
+import io
+import os
+import regex as re
+
+from .run_report import instrumentation, instrumented
+from .storage import S3Backend, csv_to_s3, csv_from_s3
+
+##########
+# SECTION I - CHART PULLS
+##########
+
+CHART_USER_AGENT = 'txx3ej@virginia.edu'
+CHART_ROW_CLASS = 'o-chart-results-list-row-container'
+
+# lxml (compiled, much faster) when bs4 has it registered, else the pure python parser
+CHART_PARSER = 'lxml' if builder_registry.lookup('lxml') is not None else 'html.parser'
+
+@instrumented
+def pull_charts(url : str, date : datetime.date, session=None):
+    """
+    GOAL - pull hot country chart for a given (valid date)
+    INPUTS - 
+        url - url to access (hot country charts base url)
+        date - chart date
+        session (optional) - requests session to reuse a keep-alive connection (see make_chart_session)
+    OUTPUTS - 
+        dataframe of charts, with song title, artist, date, rank
+    """
+    getter = session if session is not None else requests
+    r = getter.get(url+str(date), headers = {'user-agent': CHART_USER_AGENT})
+    instrumentation.add_bytes('pull_charts', len(r.content))
+    return parse_charts(r.text, date)
+
+@instrumented
+def parse_charts(html : str, date : datetime.date):
+    """
+    GOAL - parse a billboard chart page into the pull_charts dataframe, only building the tree for the chart rows
+    INPUTS - 
+        html - raw page html
+        date - chart date
+    OUTPUTS - 
+        dataframe of charts, with song title, artist, date, rank
+    """
+    rows = BeautifulSoup(html, CHART_PARSER, parse_only=SoupStrainer('div', {'class' : CHART_ROW_CLASS}))
+    list_songs = rows.find_all('div', {'class' : CHART_ROW_CLASS})
+    
+    return pd.DataFrame(([w.h3.text.strip(), 
+                        w.span.find_next('span').text.strip(),
+                        i+1,
+                        date] for i,w in enumerate(list_songs)),
+                        columns=['song', 'artist', 'rank','date'])
+
+class RateLimiter:
+    """
+    GOAL - thread-safe token bucket capping the number of calls per second, shared by all workers of a pool
+    INPUTS - 
+        calls_per_second - sustained rate at which tokens refill (float), None or 0 for no limit
+        burst - bucket size, i.e. number of calls allowed back to back after an idle period
+    """
+    
+    def __init__(self, calls_per_second, burst=1):
+        self.rate = calls_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1 # may go negative, later callers queue up behind this one
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+def make_chart_session(pool_size=8, retries=5, backoff=1.0):
+    """
+    GOAL - create a keep-alive requests session with a connection pool and retry/backoff for transient errors
+    INPUTS - 
+        pool_size - number of pooled connections (should match number of workers)
+        retries - maximum number of retries per page
+        backoff - backoff factor in seconds (sleep is backoff * 2^(retry - 1))
+    OUTPUTS - 
+        session - requests session object
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'], respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.headers.update({'user-agent': CHART_USER_AGENT})
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+@instrumented
+def fetch_chart_html(url : str, date : datetime.date, session, rate_limiter=None, fixture_folder=None, offline=False):
+    """
+    GOAL - get the raw html for one chart date, either from billboard or from a saved fixture
+    INPUTS - 
+        url - url to access (hot country charts base url)
+        date - chart date
+        session - requests session (see make_chart_session)
+        rate_limiter (optional) - RateLimiter shared across workers
+        fixture_folder (optional) - folder of saved pages named <date>.html; pages pulled online are saved here
+        offline - if True, replay pages from fixture_folder instead of using the network
+    OUTPUTS - 
+        html - page html (str)
+    """
+    fixture = os.path.join(fixture_folder, f'{date}.html') if fixture_folder else None
+    
+    if offline:
+        with open(fixture, encoding='utf-8') as f:
+            return f.read()
+    
+    if rate_limiter is not None:
+        rate_limiter.wait()
+    r = session.get(url+str(date))
+    r.raise_for_status()
+    instrumentation.add_bytes('fetch_chart_html', len(r.content))
+    
+    if fixture:
+        with open(fixture, 'w', encoding='utf-8') as f:
+            f.write(r.text)
+    return r.text
+
+def pull_charts_concurrent(url : str, dates, max_workers=8, requests_per_second=2, retries=5, backoff=1.0, 
+                           fixture_folder=None, offline=False):
+    """
+    GOAL - pull many chart dates concurrently over a shared keep-alive session, capped at a fixed request rate
+    INPUTS - 
+        url - url to access (hot country charts base url)
+        dates - iterable of chart dates
+        max_workers - number of worker threads
+        requests_per_second - cap on requests per second across all workers (None for no cap)
+        retries, backoff - retry policy for transient http errors (see make_chart_session)
+        fixture_folder (optional) - folder of saved pages named <date>.html; pages pulled online are saved here
+        offline - if True, replay pages from fixture_folder instead of using the network (for benchmarking)
+    OUTPUTS - 
+        generator of (date, charts) tuples in order of completion, charts has the same schema as pull_charts
+    """
+    if offline and not fixture_folder:
+        raise ValueError('offline mode requires a fixture_folder')
+    if fixture_folder and not offline:
+        os.makedirs(fixture_folder, exist_ok=True)
+        
+    session = make_chart_session(pool_size=max_workers, retries=retries, backoff=backoff)
+    rate_limiter = RateLimiter(None if offline else requests_per_second)
+    
+    def pull_one(cd):
+        html = fetch_chart_html(url, cd, session, rate_limiter, fixture_folder, offline)
+        return parse_charts(html, cd)
+    
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(pull_one, cd) : cd for cd in dates}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        except BaseException: # a failed date (or the caller stopping early) drops the queued dates instead of pulling them first
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    
+
+##########
+# SECTION I - CHART TABLES
+##########
+
+CHART_DTYPES = {'title' : 'category', 'artist' : 'category', 'rank' : 'int8'}
+
+def chart_date_from_key(key : str):
+    '''
+    GOAL - get the chart date from a weekly chart file name (e.g. data/charts/CHARTS_2022-04-23.csv -> 2022-04-23)
+    INPUTS - 
+        key - S3 key or file name of a weekly chart
+    OUTPUTS - 
+        pd.Timestamp of the chart date
+    '''
+    return pd.Timestamp(key.split('/')[-1].replace('CHARTS_', '').replace('.csv', ''))
+
+def combine_charts(frames):
+    '''
+    GOAL - concatenate chart tables in a single pass and enforce chart dtypes (category artist/title, int8 rank, datetime date)
+    INPUTS - 
+        frames - list of chart dataframes with title, artist, rank, date columns
+    OUTPUTS - 
+        charts - one chart dataframe
+    '''
+    frames = [frame for frame in frames if frame is not None]
+    if not frames:
+        return pd.DataFrame({col : pd.Series(dtype=dtype) for col, dtype in {**CHART_DTYPES, 'date' : 'datetime64[ns]'}.items()})
+    
+    # categoricals with different categories would fall back to object on concat anyway, so concat as object once
+    charts = pd.concat([frame.astype({col : object for col in ['title', 'artist'] if col in frame}) for frame in frames], axis=0)
+    charts['date'] = pd.to_datetime(charts['date'])
+    return charts.astype({col : dtype for col, dtype in CHART_DTYPES.items() if col in charts})
+
+@instrumented
+def read_charts(keys, aws_client, bucket, max_workers=16, existing=None, backend=None):
+    '''
+    GOAL - read weekly chart files concurrently and aggregate them into one chart table (title lowercased, song renamed to title)
+    INPUTS - 
+        keys - list of weekly chart keys (CHARTS_<date>.csv)
+        aws_client - AWS client associated with folder (AWS client object)
+        bucket - name of bucket (str)
+        max_workers - number of concurrent downloads
+        existing (optional) - previously aggregated chart table, only weeks missing from its date column are read
+        backend (optional) - storage backend replacing aws_client/bucket
+    OUTPUTS - 
+        charts - chart table of existing and new weeks
+    '''
+    backend = backend if backend is not None else S3Backend(aws_client, bucket)
+    
+    if existing is not None and len(existing):
+        pulled_dates = set(pd.to_datetime(existing['date']).unique())
+        keys = [key for key in keys if chart_date_from_key(key) not in pulled_dates]
+    
+    def read_one(key):
+        that_week = pd.read_csv(backend.get_fileobj(key), index_col=0, dtype={'song' : str, 'artist' : str})
+        that_week = that_week.rename(columns={'song' : 'title'}) # change column name
+        that_week['title'] = that_week['title'].str.lower()
+        return that_week
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        new_weeks = list(executor.map(read_one, keys)) # map keeps key order
+        
+    return combine_charts([existing] + new_weeks)
+
+ARTIST_SEPARATORS = [' x ', 'featuring', ' duet ', ' with '] # applied in order, the part before each is kept
+
+def normalize_artists(artists):
+    '''
+    GOAL - canonical artist name (artist_strip) of raw chart artists: lowercased, featured / duet / "with" artists dropped
+    INPUTS - 
+        artists - iterable of distinct raw artist strings
+    OUTPUTS - 
+        pd series of artist_strip, aligned with artists
+    '''
+    stripped = pd.Series(list(artists), dtype=object).astype(str).str.lower()
+    for separator in ARTIST_SEPARATORS:
+        stripped = stripped.str.split(separator, n=1, regex=False).str[0]
+    return stripped.str.strip()
+
+def song_id(titles, artist_strips):
+    '''
+    GOAL - song identifier used as the LIB / LYRICS key: "<title>-<artist_strip>"
+    '''
+    return titles + '-' + artist_strips
+
+class ArtistAliases:
+    """
+    GOAL - memoized artist normalization: raw chart artist -> artist_strip, persisted as an alias table so every raw 
+           spelling is normalized once across runs; a chart column is mapped through its categorical codes, so the string 
+           work is per distinct artist rather than per chart row
+    INPUTS - 
+        aliases (optional) - dict of raw artist -> artist_strip
+    """
+    
+    def __init__(self, aliases=None):
+        self.aliases = dict(aliases) if aliases is not None else {}
+        self.changed = False
+        
+    @classmethod
+    def load(cls, backend, key):
+        if not backend.exists(key):
+            return cls()
+        table = pd.read_csv(backend.get_fileobj(key), dtype=str, keep_default_na=False)
+        return cls(zip(table.artist, table.artist_strip))
+    
+    def save(self, backend, key):
+        if self.changed or not backend.exists(key):
+            table = pd.DataFrame({'artist' : list(self.aliases), 'artist_strip' : list(self.aliases.values())})
+            backend.put_fileobj(io.BytesIO(table.to_csv(index=False).encode('utf-8')), key)
+            self.changed = False
+            
+    @instrumented
+    def normalize(self, artists):
+        '''
+        GOAL - artist_strip for every row of a raw artist column
+        INPUTS - 
+            artists - pd series of raw artists (categorical or not), missing artists become 'nan' as with astype(str)
+        OUTPUTS - 
+            pd series of artist_strip with the index of artists
+        '''
+        categorical = artists.astype('category') if not isinstance(artists.dtype, pd.CategoricalDtype) else artists
+        categories = categorical.cat.categories.astype(str)
+        new = [artist for artist in pd.unique(np.append(categories, 'nan')) if artist not in self.aliases]
+        if new:
+            self.aliases.update(zip(new, normalize_artists(new)))
+            self.changed = True
+        canonical = np.array([self.aliases[artist] for artist in categories] + [self.aliases['nan']], dtype=object)
+        return pd.Series(canonical[categorical.cat.codes.to_numpy()], index=artists.index) # code -1 (missing) -> last
+
+class SongStats:
+    """
+    GOAL - incremental song statistics for LIB and TOP_SONGS_ORDER: first / last chart week, peak rank and weeks on chart 
+           per (title, artist_strip), plus every week's #1 row; update only aggregates chart weeks it has not seen, and 
+           the state is persisted so a new week touches only the songs charting in it
+    INPUTS - 
+        excluded_artists - artist_strip values that are not artists (chart annotations)
+    """
+    
+    KEYS = ['title', 'artist_strip']
+    
+    def __init__(self, excluded_artists=('new', 're-entry')):
+        self.excluded_artists = list(excluded_artists)
+        self.stats = None
+        self.number_ones = None
+        self.weeks = set()
+        
+    @instrumented
+    def update(self, charts):
+        '''
+        GOAL - fold chart weeks not seen yet into the statistics, one groupby over the new rows
+        INPUTS - 
+            charts - chart table (title, artist, rank, date, artist_strip), may include weeks already counted
+        OUTPUTS - 
+            number of new weeks
+        '''
+        dates = pd.to_datetime(charts['date'])
+        new = charts[~dates.isin(pd.DatetimeIndex(sorted(self.weeks)))]
+        if not len(new):
+            return 0
+        new_weeks = set(pd.to_datetime(new['date']).unique())
+        
+        ones = new[new['rank'] == 1].astype({'title' : object, 'artist' : object})
+        self.number_ones = ones if self.number_ones is None else pd.concat([self.number_ones, ones])
+        
+        songs = new[~new.artist_strip.isin(self.excluded_artists)]
+        week_stats = songs.groupby(self.KEYS, observed=True).agg(min=('date', 'min'), max=('date', 'max'), 
+                                                                 min_rank=('rank', 'min'), weeks=('date', 'size'))
+        week_stats.index = pd.MultiIndex.from_arrays([week_stats.index.get_level_values(key).astype(object) for key in self.KEYS])
+        self.weeks |= new_weeks
+        if self.stats is None:
+            self.stats = week_stats
+            return len(new_weeks)
+        
+        # combine with songs already charted, only the rows of songs in the new weeks are touched
+        charted = week_stats.index.intersection(self.stats.index)
+        old, add = self.stats.loc[charted], week_stats.loc[charted]
+        self.stats.loc[charted, 'min'] = old['min'].where(old['min'] <= add['min'], add['min'])
+        self.stats.loc[charted, 'max'] = old['max'].where(old['max'] >= add['max'], add['max'])
+        self.stats.loc[charted, 'min_rank'] = np.minimum(old['min_rank'], add['min_rank'])
+        self.stats.loc[charted, 'weeks'] = old['weeks'] + add['weeks']
+        self.stats = pd.concat([self.stats, week_stats.loc[week_stats.index.difference(charted)]])
+        return len(new_weeks)
+    
+    def table(self):
+        '''
+        GOAL - song statistics with year / decade of the first chart week, one row per (title, artist_strip)
+        '''
+        table = self.stats.reset_index()
+        table['year'] = table['min'].dt.year
+        table['decade'] = table['year'] // 10 * 10
+        return table
+    
+    def top_songs_order(self):
+        '''
+        GOAL - sequence of #1 songs: weekly #1 rows in date order, consecutive weeks of the same title collapsed
+        '''
+        ones = self.number_ones.sort_values('date', kind='stable')
+        return ones[ones.title != ones.title.shift(1)].reset_index(drop=True)
+    
+    def save(self, backend, folder):
+        csv_to_s3(self.stats, 'SONG-STATS.csv', None, None, aws_folder=folder, backend=backend)
+        csv_to_s3(self.number_ones, 'NUMBER-ONES.csv', None, None, aws_folder=folder, backend=backend)
+        weeks = json.dumps(sorted(str(week.date()) for week in self.weeks))
+        backend.put_fileobj(io.BytesIO(weeks.encode('utf-8')), folder + '/weeks.json')
+        
+    @classmethod
+    def load(cls, backend, folder, **kwargs):
+        '''
+        GOAL - saved state, or an empty engine if there is none yet (first run counts every week)
+        '''
+        song_stats = cls(**kwargs)
+        if backend.exists(folder + '/weeks.json'):
+            song_stats.weeks = set(pd.to_datetime(json.load(backend.get_fileobj(folder + '/weeks.json'))))
+            song_stats.stats = csv_from_s3('SONG-STATS.csv', None, None, folder, backend=backend, index_col=[0, 1], 
+                                           parse_dates=['min', 'max'], dtype={'title' : str, 'artist_strip' : str})
+            song_stats.number_ones = csv_from_s3('NUMBER-ONES.csv', None, None, folder, backend=backend, index_col=0, 
+                                                 parse_dates=['date'], dtype={'title' : object, 'artist' : object})
+        return song_stats
+
+##########
+# SECTION II - GENIUS CONNECTIONS
+##########
+
+@instrumented
+def get_lyrics(title : str, artist : str, genius_driver):
+    '''
+    GOAL - pull lyrics string for one song
+    INPUTS - 
+        title - song title
+        artist - artist name
+        genius_driver - instantiated genius driver object created with api token
+    OUTPUTS - 
+        lyrics - a string containing the song's lyrics
+    '''
+    
+    raw_lyrics = genius_driver.search_song(title=title, artist=artist)
+    if raw_lyrics:
+        lyrics = re.sub(r'[0-9]+Embed', '', re.sub(r'\[[^]]*\]', '', raw_lyrics.lyrics))
+        lyrics = '\n'.join(lyrics.split('\n')[1:])
+    else:
+        lyrics = 'song not found'
+    return lyrics
+
+class LyricsCache:
+    """
+    GOAL - persistent on-disk cache of genius results keyed on (title, artist_strip), including 'song not found' results,
+           stored as an append-only json lines file so it can be shared by reruns and the pop-chart variant
+    INPUTS - 
+        path - local path of the cache file
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.results = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # partially written last line after a crash
+                        continue
+                    self.results[(entry['title'], entry['artist'])] = entry['lyrics']
+                    
+    def get(self, title, artist):
+        return self.results.get((title, artist))
+    
+    def put(self, title, artist, lyrics):
+        with self.lock:
+            self.results[(title, artist)] = lyrics
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'title' : title, 'artist' : artist, 'lyrics' : lyrics}) + '\n')
+
+def get_lyrics_concurrent(songs, genius_driver, cache=None, max_workers=4, calls_per_second=2, burst=4, retries=4, backoff=2.0):
+    '''
+    GOAL - pull lyrics for many songs with a bounded worker pool, a shared token-bucket rate limit and retry with exponential backoff
+    INPUTS - 
+        songs - iterable of (song_id, title, artist) tuples
+        genius_driver - instantiated genius driver object (set its timeout for per-request timeouts), or any object with a 
+                        compatible search_song(title=..., artist=...) method
+        cache (optional) - LyricsCache, cached songs are returned without searching and new results are added to it
+        max_workers - number of concurrent searches
+        calls_per_second, burst - token-bucket rate limit across all workers
+        retries - number of retries per song after a failed search (timeouts, http errors)
+        backoff - base backoff in seconds, the n-th retry sleeps backoff * 2^n
+    OUTPUTS - 
+        generator of (song_id, lyrics) tuples in order of completion, lyrics is None if every attempt failed
+    '''
+    rate_limiter = RateLimiter(calls_per_second, burst)
+    
+    def pull_one(title, artist):
+        for attempt in range(retries + 1):
+            rate_limiter.wait()
+            try:
+                lyrics = get_lyrics(title, artist, genius_driver)
+            except Exception:
+                if attempt == retries:
+                    return None
+                time.sleep(backoff * 2 ** attempt)
+                continue
+            if cache is not None:
+                cache.put(title, artist, lyrics)
+            return lyrics
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for song_id, title, artist in songs:
+            cached = cache.get(title, artist) if cache is not None else None
+            if cached is not None:
+                yield song_id, cached
+            else:
+                futures[executor.submit(pull_one, title, artist)] = song_id
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+LYRICS_COMPACT_SHARDS = 20 # shards kept before they are compacted into one
+
+class LyricsStore:
+    """
+    GOAL - append-only lyrics store made of small immutable csv shards plus a json manifest listing committed shards
+           a batch is committed by writing its shard and then replacing the manifest (single put), so a crash mid-batch
+           leaves at most an orphaned shard that is never read
+    INPUTS - 
+        aws_client - AWS client associated with folder (AWS client object)
+        bucket - name of bucket (str)
+        prefix - folder holding the shards and manifest (e.g. 'data/lyrics-shards')
+        backend (optional) - storage backend replacing aws_client/bucket
+    """
+    
+    def __init__(self, aws_client, bucket, prefix, backend=None):
+        self.backend = backend if backend is not None else S3Backend(aws_client, bucket)
+        self.prefix = prefix
+        self.manifest_key = prefix + '/MANIFEST.json'
+        self.load()
+        
+    def load(self):
+        '''
+        GOAL - (re)read the manifest, the only read needed to know which songs are already stored
+        '''
+        if self.backend.exists(self.manifest_key):
+            self.manifest = json.load(self.backend.get_fileobj(self.manifest_key))
+        else:
+            self.manifest = {'next_shard' : 0, 'shards' : []}
+        self.song_ids = set(song_id for shard in self.manifest['shards'] for song_id in shard['song_ids'])
+        return self
+        
+    @instrumented
+    def commit(self, lyrics : pd.DataFrame):
+        '''
+        GOAL - atomically append one batch of lyrics as a new shard
+        INPUTS - 
+            lyrics - dataframe indexed by song_id with a lyrics column
+        OUTPUTS - None
+        '''
+        if not len(lyrics):
+            return
+        shard_key = f"{self.prefix}/shard-{self.manifest['next_shard']:06d}.csv"
+        csv_to_s3(lyrics, shard_key, None, None, backend=self.backend)
+        
+        manifest = {'next_shard' : self.manifest['next_shard'] + 1,
+                    'shards' : self.manifest['shards'] + [{'key' : shard_key, 'song_ids' : list(lyrics.index)}]}
+        self.backend.put_fileobj(io.BytesIO(json.dumps(manifest).encode('utf-8')), self.manifest_key)
+        self.manifest = manifest
+        self.song_ids.update(lyrics.index)
+        
+    def read(self, max_workers=16):
+        '''
+        GOAL - read all committed shards into one lyrics table (concurrent reads, single concat)
+        OUTPUTS - 
+            lyrics - dataframe indexed by song_id with a lyrics column
+        '''
+        read_one = lambda shard : pd.read_csv(self.backend.get_fileobj(shard['key']), index_col='song_id')
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            shards = list(executor.map(read_one, self.manifest['shards']))
+        if not shards:
+            return pd.DataFrame({'lyrics' : pd.Series(dtype=str)}, index=pd.Index([], name='song_id'))
+        lyrics = pd.concat(shards, axis=0)
+        return lyrics[~lyrics.index.duplicated(keep='last')]
+    
+    @instrumented
+    def compact(self, filename, aws_folder, min_shards=LYRICS_COMPACT_SHARDS):
+        '''
+        GOAL - merge all shards into one LYRICS table; once there are min_shards shards they are also replaced in the 
+               manifest by a single compacted shard and deleted
+        INPUTS - 
+            filename - name of the merged lyrics table (e.g. 'LYRICS.csv')
+            aws_folder - folder of the merged lyrics table
+            min_shards - number of shards from which they are compacted
+        OUTPUTS - 
+            lyrics - the merged lyrics table
+        '''
+        lyrics = self.read()
+        csv_to_s3(lyrics, filename, None, None, aws_folder=aws_folder, backend=self.backend)
+        if len(self.manifest['shards']) < min_shards:
+            return lyrics
+        
+        try:
+            self.manifest = {'next_shard' : self.manifest['next_shard'], 'shards' : []}
+            self.song_ids = set()
+            self.commit(lyrics)
+        except BaseException:
+            self.load() # the manifest on storage still lists the old shards
+            raise
+            
+        # only once the new manifest is stored: delete every shard it does not list (superseded ones, orphans of crashed batches)
+        listed = {shard['key'] for shard in self.manifest['shards']}
+        for key in self.backend.keys(self.prefix + '/shard-'):
+            if key not in listed:
+                self.backend.delete(key)
+        return lyrics
@@ -0,0 +1,775 @@
+##########
+# Functions to assist with country lyrics project - storage backends, csv and parquet tables
+# Author - Timur Guler (https://github.com/timurguler)
+##########
+
+##########
+# PREEQUISISITES
+##########
+
+import pandas as pd
+import numpy as np
+import io
+import os
+import json
+import gzip
+import shutil
+import threading
+import time
+import atexit
+from contextlib import contextmanager
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+try:
+    import zstandard # optional, only needed for compression='zstd'
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl # posix only, the cache index is not locked across processes without it
+except ImportError:
+    fcntl = None
+
+pa = pq = None # pyarrow (optional, only needed for parquet tables) is imported on first use, see _require_pyarrow
+
+from .run_report import instrumentation, instrumented, _CountingReader
+
+##########
+# SECTION I - AWS CONNECTIONS
+##########
+
+STREAM_CHUNK_ROWS = 500000 # tables longer than this are streamed in chunks rather than serialized in one piece
+MULTIPART_CHUNK_BYTES = 16 * 1024 * 1024
+
+class S3Backend:
+    """
+    GOAL - storage backend writing to / reading from an S3 bucket (multipart uploads for large streams)
+    INPUTS - 
+        aws_client - relevant aws client (aws client object)
+        bucket - s3 bucket name (s3)
+    """
+    
+    def __init__(self, aws_client, bucket):
+        self.aws_client = aws_client
+        self.bucket = bucket
+        self.transfer_config = TransferConfig(multipart_threshold=MULTIPART_CHUNK_BYTES, multipart_chunksize=MULTIPART_CHUNK_BYTES)
+        
+    @instrumented
+    def put_fileobj(self, fileobj, key):
+        if instrumentation.enabled:
+            fileobj = _CountingReader(fileobj, 'S3Backend.put_fileobj')
+        self.aws_client.upload_fileobj(fileobj, self.bucket, key, Config=self.transfer_config)
+        
+    @instrumented
+    def get_fileobj(self, key):
+        body = self.aws_client.get_object(Bucket=self.bucket, Key=key)['Body']
+        return _CountingReader(body, 'S3Backend.get_fileobj') if instrumentation.enabled else body
+    
+    def exists(self, key):
+        try:
+            self.aws_client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+    
+    def delete(self, key):
+        self.aws_client.delete_object(Bucket=self.bucket, Key=key)
+        
+    def etag(self, key):
+        try:
+            return self.aws_client.head_object(Bucket=self.bucket, Key=key)['ETag']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+            
+    def keys(self, prefix):
+        return list_files(self.aws_client, self.bucket, prefix)
+    
+    def etags(self, prefix):
+        # key -> etag for every key under prefix from the listing itself (one request per 1000 keys, no head per key)
+        etags = {}
+        for page in self.aws_client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+            etags.update((file['Key'], file['ETag']) for file in page.get('Contents', []))
+        return etags
+    
+class LocalBackend:
+    """
+    GOAL - storage backend using a local directory as a stand-in for an S3 bucket (tests, benchmarks)
+    INPUTS - 
+        root - local directory acting as the bucket, keys become relative paths
+    """
+    
+    def __init__(self, root):
+        self.root = root
+        
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+        
+    def put_fileobj(self, fileobj, key):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path + '.part', 'wb') as f:
+                shutil.copyfileobj(fileobj, f, MULTIPART_CHUNK_BYTES)
+        except Exception:
+            os.remove(path + '.part')
+            raise
+        os.replace(path + '.part', path) # only expose complete files, like an S3 put
+        
+    def get_fileobj(self, key):
+        return open(self.path(key), 'rb')
+    
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+    
+    def delete(self, key):
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+            
+    def etag(self, key):
+        if not os.path.exists(self.path(key)):
+            return None
+        stat = os.stat(self.path(key))
+        return f'{stat.st_mtime_ns:x}-{stat.st_size:x}' # stands in for the S3 ETag, changes on every put
+    
+    def keys(self, prefix):
+        keys = []
+        for root, dirs, files in os.walk(self.root):
+            for file in files:
+                key = os.path.relpath(os.path.join(root, file), self.root).replace(os.sep, '/')
+                if key.startswith(prefix) and not key.endswith('.part'):
+                    keys.append(key)
+        return sorted(keys)
+    
+    def etags(self, prefix):
+        return {key : self.etag(key) for key in self.keys(prefix)}
+    
+CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+class CachedBackend:
+    """
+    GOAL - read-through local disk cache in front of a storage backend: objects are kept under cache_dir/<bucket>/<key>, 
+           revalidated against the backend's ETag on every read (one HEAD request instead of a download), and evicted 
+           least-recently-used once the cache exceeds max_bytes. The index on disk is shared by concurrent processes: 
+           each process keeps its own changes pending and merges them into the index under a file lock on misses, 
+           writes, deletes and at exit
+    INPUTS - 
+        backend - S3Backend / LocalBackend holding the objects
+        cache_dir - local cache folder, shared by scripts and notebook sessions
+        max_bytes - size bound of the cache
+    ATTRIBUTES - 
+        stats - dict of hits, misses, bytes_downloaded and evictions since creation
+    """
+    
+    def __init__(self, backend, cache_dir, max_bytes=CACHE_MAX_BYTES):
+        self.backend = backend
+        name = backend.bucket if hasattr(backend, 'bucket') else os.path.basename(os.path.normpath(backend.root))
+        self.root = os.path.join(cache_dir, name)
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(self.root, 'cache-index.json')
+        self.lock = threading.Lock()
+        self.stats = {'hits' : 0, 'misses' : 0, 'bytes_downloaded' : 0, 'evictions' : 0}
+        self.pending = {} # key -> entry (or None if removed) not yet merged into the index on disk
+        os.makedirs(self.root, exist_ok=True)
+        with self._index_lock():
+            self.index = self._load_index()
+        atexit.register(self.close)
+    
+    def _local(self, key):
+        return os.path.join(self.root, *key.split('/'))
+    
+    @contextmanager
+    def _index_lock(self):
+        # serializes index updates across processes sharing cache_dir (threads are serialized by self.lock)
+        if fcntl is None:
+            yield
+            return
+        with open(self.index_path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _sync(self, keep=None):
+        # call with self.lock held: merge pending changes into the index on disk, evict (if keep is given) and save
+        with self._index_lock():
+            index = self._load_index()
+            for key, entry in self.pending.items():
+                if entry is None:
+                    index.pop(key, None)
+                elif key in index and index[key]['etag'] == entry['etag']:
+                    index[key] = {**entry, 'last_used' : max(entry['last_used'], index[key]['last_used'])}
+                else:
+                    index[key] = entry
+            self.index = index
+            self.pending = {}
+            if keep is not None:
+                self._evict(keep)
+            part = f'{self.index_path}.{os.getpid()}.part'
+            with open(part, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f)
+            os.replace(part, self.index_path)
+    
+    def _drop(self, key):
+        # call with self.lock held: forget key and remove its stale local copy
+        self.index.pop(key, None)
+        self.pending[key] = None
+        if os.path.exists(self._local(key)):
+            os.remove(self._local(key))
+    
+    def close(self):
+        '''
+        GOAL - write the pending last-used times of cache hits to the index on disk (also run at exit)
+        '''
+        with self.lock:
+            if self.pending:
+                self._sync()
+        
+    def _evict(self, keep):
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k : self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep: # the object being read stays, even if it alone exceeds max_bytes
+                continue
+            total -= self.index.pop(key)['size']
+            if os.path.exists(self._local(key)):
+                os.remove(self._local(key))
+            self.stats['evictions'] += 1
+    
+    def path(self, key):
+        '''
+        GOAL - local path of an up-to-date copy of key, downloaded only if missing from the cache or changed upstream
+        INPUTS - 
+            key - object key
+        OUTPUTS - 
+            local file path, or None if the key does not exist in the backend
+        '''
+        etag = self.backend.etag(key)
+        if etag is None:
+            return None
+        local = self._local(key)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is not None and entry['etag'] == etag and os.path.exists(local):
+                entry['last_used'] = time.time()
+                self.pending[key] = entry # persisted on the next miss or at exit, not on every hit
+                self.stats['hits'] += 1
+                return local
+        
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        part = f'{local}.{threading.get_ident()}.part'
+        with open(part, 'wb') as f:
+            shutil.copyfileobj(self.backend.get_fileobj(key), f, MULTIPART_CHUNK_BYTES)
+        os.replace(part, local)
+        size = os.path.getsize(local)
+        with self.lock:
+            self.pending[key] = {'etag' : etag, 'size' : size, 'last_used' : time.time()}
+            self.stats['misses'] += 1
+            self.stats['bytes_downloaded'] += size
+            self._sync(keep=key)
+        return local
+    
+    def folder(self, prefix):
+        '''
+        GOAL - cache every object under prefix (e.g. the encoded corpus or a checkpoint folder) and return the local folder
+        '''
+        for key in self.backend.keys(prefix):
+            self.path(key)
+        return self._local(prefix.rstrip('/'))
+        
+    def get_fileobj(self, key):
+        local = self.path(key)
+        if local is None:
+            return self.backend.get_fileobj(key) # raises the backend's own not-found error
+        return open(local, 'rb')
+    
+    def put_fileobj(self, fileobj, key):
+        self.backend.put_fileobj(fileobj, key)
+        with self.lock:
+            self._drop(key) # refetched (once) on the next read
+            self._sync()
+    
+    def exists(self, key):
+        return self.backend.exists(key)
+    
+    def delete(self, key):
+        self.backend.delete(key)
+        with self.lock:
+            self._drop(key)
+            self._sync()
+            
+    def etag(self, key):
+        return self.backend.etag(key)
+    
+    def keys(self, prefix):
+        return self.backend.keys(prefix)
+    
+    def etags(self, prefix):
+        return self.backend.etags(prefix)
+    
+def open_storage(aws_client, bucket, cache_dir=os.path.join('..', 'data', 'cache'), max_bytes=CACHE_MAX_BYTES):
+    '''
+    GOAL - storage backend used by the scripts and notebooks: S3 behind the local read-through cache
+    INPUTS - 
+        aws_client - relevant aws client (aws client object)
+        bucket - s3 bucket name (s3)
+        cache_dir (optional) - local cache folder, None for no cache
+        max_bytes - size bound of the cache
+    OUTPUTS - 
+        backend for csv_from_s3, csv_to_s3, read_charts, ...
+    '''
+    backend = S3Backend(aws_client, bucket)
+    return CachedBackend(backend, cache_dir, max_bytes) if cache_dir is not None else backend
+    
+def compressed_writer(fileobj, compression=None):
+    '''
+    GOAL - wrap a binary file object so that everything written to it is compressed
+    INPUTS - 
+        fileobj - binary file object to write to
+        compression - None, 'gzip' or 'zstd' (zstd requires the zstandard package)
+    OUTPUTS - 
+        writer - binary file object, closing it flushes the compressor but leaves fileobj open
+    '''
+    if compression is None:
+        return _Unclosable(fileobj)
+    elif compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("compression='zstd' requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3).stream_writer(fileobj, closefd=False)
+    else:
+        raise ValueError(f'unknown compression {compression}, use None, gzip or zstd')
+
+class _Unclosable(io.RawIOBase):
+    # pass-through writer so that all compression modes can be closed the same way
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+    def writable(self):
+        return True
+    def write(self, b):
+        return self.fileobj.write(b)
+
+def write_csv(csv, fileobj, compression=None, chunk_rows=STREAM_CHUNK_ROWS):
+    '''
+    GOAL - serialize a pd dataframe/series as csv into a binary file object, chunk by chunk so memory stays bounded
+    INPUTS - 
+        csv - python object to serialize as csv
+        fileobj - binary file object to write to
+        compression - None, 'gzip' or 'zstd'
+        chunk_rows - number of rows serialized at a time
+    OUTPUTS - None
+    '''
+    writer = compressed_writer(fileobj, compression)
+    n_rows = len(csv)
+    for start in range(0, max(n_rows, 1), chunk_rows):
+        writer.write(csv.iloc[start:start+chunk_rows].to_csv(header=(start == 0)).encode('utf-8'))
+    writer.close()
+    
+class TableWriter:
+    """
+    GOAL - incremental csv writer to a storage backend: chunks written with write() are serialized into a pipe
+           that a background thread uploads as it fills, so memory stays bounded by a chunk plus an upload part
+    INPUTS - 
+        backend - storage backend (S3Backend or LocalBackend)
+        key - destination key
+        compression - None, 'gzip' or 'zstd'
+    """
+    
+    def __init__(self, backend, key, compression=None):
+        read_fd, write_fd = os.pipe()
+        self.pipe_out = open(write_fd, 'wb')
+        self.writer = compressed_writer(self.pipe_out, compression)
+        self.header = True
+        self.errors = []
+        
+        self.aborted = False
+        
+        def consume():
+            try:
+                with open(read_fd, 'rb') as pipe_in:
+                    backend.put_fileobj(_AbortableReader(pipe_in, self), key)
+            except Exception as e:
+                self.errors.append(e)
+                
+        self.uploader = threading.Thread(target=consume, daemon=True)
+        self.uploader.start()
+        
+    def write(self, csv):
+        self.writer.write(csv.to_csv(header=self.header).encode('utf-8'))
+        self.header = False
+        
+    def close(self):
+        try:
+            self.writer.close()
+        except BaseException:
+            self.aborted = True # a failed final flush must not publish a truncated table either
+            raise
+        finally:
+            self.pipe_out.close() # always end the stream, otherwise the uploader waits on the pipe forever
+            self.uploader.join()
+        if self.errors:
+            raise self.errors[0]
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.aborted = True # fail the upload instead of publishing a truncated table
+        try:
+            self.close()
+        except Exception:
+            if exc[0] is None or issubclass(exc[0], BrokenPipeError): # a broken pipe means the upload failed first
+                raise
+            
+class _AbortableReader(io.RawIOBase):
+    # read end of a TableWriter pipe, raising at end of stream if the writer was aborted
+    def __init__(self, pipe_in, table_writer):
+        self.pipe_in = pipe_in
+        self.table_writer = table_writer
+    def readable(self):
+        return True
+    def read(self, size=-1):
+        data = self.pipe_in.read(size)
+        if not data and self.table_writer.aborted:
+            raise IOError('table write aborted')
+        return data
+    
+def _stream_csv(csv, backend, key, compression, chunk_rows):
+    with TableWriter(backend, key, compression) as writer:
+        for start in range(0, max(len(csv), 1), chunk_rows):
+            writer.write(csv.iloc[start:start+chunk_rows])
+
+@instrumented
+def csv_to_s3(csv, filename, aws_client, bucket, temp_folder=None, aws_folder='', compression=None, chunk_rows=None, backend=None):
+    '''
+    GOAL - move pd dataframe or other csv-compatible file to aws s3, serializing in memory (no local temp file)
+    INPUTS - 
+        csv - python object to upload as csv
+        filename - desired end filename (str), add .gz/.zst yourself when compressing
+        aws_client - relevant aws client (aws client object)
+        bucket - s3 bucket name (s3)
+        temp_folder (deprecated) - no longer used, kept so existing calls keep working
+        aws_folder - name of AWS folder where file is to be saved
+        compression (optional) - None, 'gzip' or 'zstd'
+        chunk_rows (optional) - stream in chunks of this many rows with bounded memory (default: stream tables longer than STREAM_CHUNK_ROWS)
+        backend (optional) - storage backend replacing aws_client/bucket (e.g. LocalBackend for tests)
+    OUTPUTS - None
+    '''
+    backend = backend if backend is not None else S3Backend(aws_client, bucket)
+    aws_file = aws_folder + '/' + filename if aws_folder else filename
+    
+    if chunk_rows is None and len(csv) <= STREAM_CHUNK_ROWS:
+        buffer = io.BytesIO()
+        write_csv(csv, buffer, compression, max(len(csv), 1))
+        buffer.seek(0)
+        backend.put_fileobj(buffer, aws_file)
+    else:
+        _stream_csv(csv, backend, aws_file, compression, chunk_rows or STREAM_CHUNK_ROWS)
+        
+@instrumented
+def csv_from_s3(filename, aws_client, bucket, aws_folder='', compression=None, backend=None, **read_kwargs):
+    '''
+    GOAL - read a csv written by csv_to_s3 back into a pd dataframe
+    INPUTS - 
+        filename - filename (str)
+        aws_client - relevant aws client (aws client object)
+        bucket - s3 bucket name (s3)
+        aws_folder - name of AWS folder where file is saved
+        compression (optional) - None, 'gzip' or 'zstd'
+        backend (optional) - storage backend replacing aws_client/bucket
+        read_kwargs - passed on to pd.read_csv
+    OUTPUTS - 
+        dataframe
+    '''
+    backend = backend if backend is not None else S3Backend(aws_client, bucket)
+    aws_file = aws_folder + '/' + filename if aws_folder else filename
+    body = backend.get_fileobj(aws_file)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("compression='zstd' requires the zstandard package")
+        body = zstandard.ZstdDecompressor().stream_reader(body)
+        compression = None
+    return pd.read_csv(body, compression=compression, **read_kwargs)
+    
+PARQUET_ROW_GROUP_ROWS = 250000
+
+def _require_pyarrow():
+    # import pyarrow on first use, it is heavy and only the parquet tables need it
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('parquet tables require the pyarrow package') from None
+        pa, pq = pyarrow, pyarrow.parquet
+
+# parquet types of the OHCO levels, the rest are typed from their pandas dtype ('token' is a position in the collapsed 
+# tables but the word itself in TOKENS-RNN, so it is left to its dtype)
+OHCO_PARQUET_TYPES = {'decade' : 'int64', 'year' : 'int64', 'gender' : 'string', 'artist_strip' : 'string', 'title' : 'string', 
+                      'section' : 'int64', 'line' : 'int64'}
+
+def parquet_schema(table, types=OHCO_PARQUET_TYPES):
+    '''
+    GOAL - explicit pyarrow schema for a table, from column names and dtypes rather than values, so a chunk where a text 
+           column is all NaN (e.g. gender, only tagged for top artists) is still typed string instead of null
+    INPUTS - 
+        table - dataframe (a chunk is enough), named index levels are included as columns
+        types - dict of column name -> pyarrow type alias, overriding the dtype
+    OUTPUTS - 
+        pyarrow schema
+    '''
+    _require_pyarrow()
+    table = table.reset_index() if any(name is not None for name in table.index.names) else table
+    fields = []
+    for name, dtype in table.dtypes.items():
+        if name in types:
+            fields.append(pa.field(name, pa.type_for_alias(types[name])))
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+            fields.append(pa.field(name, pa.string()))
+        else:
+            fields.append(pa.Schema.from_pandas(table[[name]].iloc[:0], preserve_index=False).field(name))
+    return pa.schema(fields)
+
+class ParquetTableWriter(TableWriter):
+    """
+    GOAL - incremental parquet writer to a storage backend, same pipe + background upload as TableWriter; chunks are 
+           buffered into row groups of row_group_rows and every column is dictionary encoded
+    INPUTS - 
+        backend - storage backend (S3Backend or LocalBackend)
+        key - destination key
+        compression - parquet codec ('zstd', 'snappy', ...)
+        row_group_rows - rows per row group
+        schema (optional) - pyarrow schema every row group is written with, default parquet_schema of the first chunk
+    """
+    
+    def __init__(self, backend, key, compression='zstd', row_group_rows=PARQUET_ROW_GROUP_ROWS, schema=None):
+        _require_pyarrow()
+        super().__init__(backend, key)
+        self.compression = compression
+        self.row_group_rows = row_group_rows
+        self.schema = schema
+        self.parquet_writer = None
+        self.buffer = []
+        self.buffered_rows = 0
+        
+    def write(self, table):
+        self.buffer.append(table)
+        self.buffered_rows += len(table)
+        if self.buffered_rows >= self.row_group_rows:
+            self._flush()
+            
+    def _flush(self):
+        if not self.buffer:
+            return
+        table = pd.concat(self.buffer)
+        self.buffer, self.buffered_rows = [], 0
+        if self.parquet_writer is None:
+            self.schema = self.schema if self.schema is not None else parquet_schema(table)
+            self.parquet_writer = pq.ParquetWriter(self.writer, self.schema, compression=self.compression, use_dictionary=True)
+        self.parquet_writer.write_table(pa.Table.from_pandas(table, schema=self.schema, preserve_index=False))
+        
+    def close(self):
+        try:
+            if not self.aborted:
+                self._flush()
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
+        finally:
+            super().close()
+            
+class PartitionedTableWriter:
+    """
+    GOAL - parquet dataset partitioned on one column, hive layout (<folder>/decade=1990/part-0.parquet), one 
+           ParquetTableWriter per partition value; readers can then skip whole decades
+    INPUTS - 
+        backend - storage backend (S3Backend or LocalBackend)
+        folder - destination folder (key prefix)
+        partition_col - column (or index level) to partition on
+        schema (optional) - pyarrow schema of the whole table (partition column included), default parquet_schema of the 
+                            first chunk of each partition
+        writer_kwargs - passed on to ParquetTableWriter
+    """
+    
+    def __init__(self, backend, folder, partition_col='decade', schema=None, **writer_kwargs):
+        self.backend = backend
+        self.folder = folder
+        self.partition_col = partition_col
+        self.schema = schema.remove(schema.get_field_index(partition_col)) if schema is not None else None
+        self.writer_kwargs = writer_kwargs
+        self.writers = {}
+        
+    @property
+    def aborted(self):
+        return any(writer.aborted for writer in self.writers.values())
+    
+    @aborted.setter
+    def aborted(self, value):
+        for writer in self.writers.values():
+            writer.aborted = value
+    
+    def write(self, table):
+        table = table.reset_index() if any(name is not None for name in table.index.names) else table
+        for value, part in table.groupby(self.partition_col, sort=False):
+            if value not in self.writers:
+                key = f'{self.folder}/{self.partition_col}={value}/part-0.parquet'
+                self.writers[value] = ParquetTableWriter(self.backend, key, schema=self.schema, **self.writer_kwargs)
+            self.writers[value].write(part.drop(columns=self.partition_col))
+            
+    def close(self):
+        errors = []
+        for writer in self.writers.values():
+            try:
+                writer.close()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            self.aborted = True
+        self.close()
+        
+@instrumented
+def table_to_s3(table, folder, aws_client, bucket, aws_folder='', partition_col='decade', chunk_rows=STREAM_CHUNK_ROWS, backend=None):
+    '''
+    GOAL - save a pd dataframe (e.g. an OHCO-indexed token table) as a decade-partitioned, dictionary-encoded parquet dataset
+    INPUTS - 
+        table - dataframe, index levels are stored as columns
+        folder - dataset name, e.g. 'TOKENS-RNN'
+        aws_client - relevant aws client (aws client object)
+        bucket - s3 bucket name (s3)
+        aws_folder - name of AWS folder to save the dataset in
+        partition_col - column (or index level) to partition on
+        chunk_rows - rows handed to the writers at a time
+        backend (optional) - storage backend replacing aws_client/bucket
+    OUTPUTS - None
+    '''
+    backend = backend if backend is not None else S3Backend(aws_client, bucket)
+    folder = aws_folder + '/' + folder if aws_folder else folder
+    with PartitionedTableWriter(backend, folder, partition_col, schema=parquet_schema(table)) as writer:
+        for start in range(0, len(table), chunk_rows):
+            writer.write(table.iloc[start:start+chunk_rows])
+            
+@instrumented
+def table_from_s3(folder, aws_client, bucket, aws_folder='', columns=None, decades=None, index=None, partition_col='decade', 
+                  backend=None):
+    '''
+    GOAL - read a parquet dataset written by table_to_s3 / collapse_corpus, only the requested columns and partitions;
+           string columns come back as categoricals
+    INPUTS - 
+        folder - dataset name, e.g. 'TOKENS-RNN'
+        aws_client - relevant aws client (aws client object)
+        bucket - s3 bucket name (s3)
+        aws_folder - name of AWS folder holding the dataset
+        columns (optional) - columns to load, default all
+        decades (optional) - partition values to load, default all
+        index (optional) - columns to set as index, e.g. OHCO[:-1]
+        partition_col - partition column name
+        backend (optional) - storage backend replacing aws_client/bucket
+    OUTPUTS - 
+        dataframe
+    '''
+    _require_pyarrow()
+    backend = backend if backend is not None else S3Backend(aws_client, bucket)
+    folder = aws_folder + '/' + folder if aws_folder else folder
+    read_columns = None if columns is None else [col for col in columns if col != partition_col]
+    
+    tables = []
+    for key in backend.keys(folder + '/'):
+        if not key.endswith('.parquet'):
+            continue
+        value = int(key[len(folder)+1:].split('/')[0].split('=', 1)[1])
+        if decades is not None and value not in decades:
+            continue
+        body = backend.get_fileobj(key)
+        source = body if getattr(body, 'seekable', lambda : False)() else pa.BufferReader(body.read())
+        table = pq.read_table(source, columns=read_columns)
+        if columns is None or partition_col in columns:
+            table = table.add_column(0, partition_col, pa.array(np.full(table.num_rows, value, dtype=np.int64)))
+        tables.append(table)
+        
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    table = pa.concat_tables(tables).to_pandas(strings_to_categorical=True) # one conversion, categories shared by all decades
+    if columns is not None:
+        table = table[columns]
+    return table.set_index(index) if index is not None else table
+
+def compare_table_formats(table, backend, name='TABLE', columns=None, decades=None):
+    '''
+    GOAL - measure a table stored as csv (csv_to_s3) against the partitioned parquet dataset (table_to_s3): 
+           stored bytes and load times (full table, and a column / decade selection)
+    INPUTS - 
+        table - dataframe to store (e.g. an OHCO-indexed token table)
+        backend - storage backend to write to, a LocalBackend keeps network time out of the measurement
+        name - file / dataset name
+        columns, decades (optional) - selection for the selective parquet read
+    OUTPUTS - 
+        report - dict of sizes (bytes), load times (s) and ratios
+    '''
+    index = [name for name in table.index.names if name is not None]
+    csv_to_s3(table, name + '.csv', None, None, backend=backend)
+    table_to_s3(table, name, None, None, backend=backend)
+    csv_bytes = len(backend.get_fileobj(name + '.csv').read())
+    parquet_bytes = sum(len(backend.get_fileobj(key).read()) for key in backend.keys(name + '/'))
+    
+    start = time.perf_counter()
+    csv_from_s3(name + '.csv', None, None, backend=backend, index_col=list(range(len(index))) or None)
+    csv_s = time.perf_counter() - start
+    start = time.perf_counter()
+    table_from_s3(name, None, None, backend=backend, index=index or None)
+    parquet_s = time.perf_counter() - start
+    start = time.perf_counter()
+    table_from_s3(name, None, None, backend=backend, columns=columns, decades=decades)
+    selective_s = time.perf_counter() - start
+    
+    return {'csv_bytes' : csv_bytes, 'parquet_bytes' : parquet_bytes, 'size_ratio' : csv_bytes / parquet_bytes,
+            'csv_load_s' : csv_s, 'parquet_load_s' : parquet_s, 'load_speedup' : csv_s / parquet_s,
+            'parquet_selective_load_s' : selective_s}
+
+@instrumented
+def list_files(aws_client, bucket, prefix):
+    '''
+    GOAL - list all files in a certain S3 folder
+    INPUTS - 
+        aws_client - AWS client associated with folder (AWS client object)
+        bucket - name of bucket (str)
+        prefix - folder name (str)
+        
+    OUTPUTS - 
+        files - list of files in bucket
+    '''
+    paginator = aws_client.get_paginator('list_objects_v2')
+    pages = paginator.paginate(Bucket=bucket, Prefix=prefix)
+
+    files_dict = {}
+
+    page_num = 1
+    for page in pages:
+        files_dict[page_num] = [file.get('Key') for file in page.get('Contents', [])] # no contents on an empty prefix
+        page_num += 1
+        
+    files = []
+
+    _ = [[files.append(val) for val in v] for k, v in files_dict.items()]
+    
+    return files
@@ -0,0 +1,140 @@
+'''
+PIPELINE RUNNER - NUMBERED SCRIPTS AND NOTEBOOKS AS ONE INCREMENTAL PIPELINE
+
+CHARTS -> LIB -> LYRICS -> CORPUS -> CORPUS-REDUCED -> SECTION/LINE/TOKEN -> TOKENS-RNN -> encoded-rnn -> BOW/topic probs -> models
+each stage reruns only when the etags of its inputs, its code or its params changed since its last successful run
+
+python run-pipeline.py                  # bring everything up to date
+python run-pipeline.py --dry-run        # only show what would run
+python run-pipeline.py lib lyrics       # bring these stages (and what they depend on) up to date
+python run-pipeline.py --force corpus   # rerun corpus even if current
+'''
+
+##########
+# STEP 0 - IMPORT NECESSARY PACKAGES AND SET UP AWS ENVIRONMENT
+##########
+
+import os
+import sys
+import datetime
+from datetime import date
+import dotenv
+import boto3
+
+import country_functions as cf
+
+# set working directory to location of .env file
+env_path = '..' # change this location to run on your own directory
+original_path = os.getcwd()
+os.chdir(env_path)
+
+# Load .env and save variables
+dotenv.load_dotenv()
+access_key_id=os.getenv('s3_guler_key') # change to name of access key id in your own .env
+access_key_secret=os.getenv('s3_guler_id') # change to name of access key secret in your own .env
+
+# change back working directory to notebook location
+os.chdir(original_path)
+
+# Connect to S3
+
+s3 = boto3.client(
+    service_name='s3',
+    region_name='us-east-1',
+    aws_access_key_id=access_key_id,
+    aws_secret_access_key=access_key_secret
+)
+
+bucket='country-bucket-guler'
+aws_folder = 'data'
+store = cf.open_storage(s3, bucket) # local read-through cache, files re-downloaded only when changed on s3
+
+run_folder = os.path.join('..', 'data', 'pipeline-runs', datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S')) # logs and executed notebooks
+
+##########
+# STEP 1 - DECLARE STAGES
+##########
+
+OHCO = ['decade', 'year', 'gender', 'artist_strip', 'title', 'section', 'line', 'token']
+
+# charts are released on saturday, the chart pull reruns once a new week is out
+today = date.today()
+latest_chart_week = (today - datetime.timedelta(days=(today.weekday() + 2))).isoformat()
+
+def notebook(path):
+    # execute a notebook, the executed copy (with outputs) goes to the run folder
+    return ['jupyter', 'nbconvert', '--to', 'notebook', '--execute', '--ExecutePreprocessor.timeout=-1',
+            '--output-dir', os.path.abspath(run_folder), path]
+
+def cf_code(*modules):
+    # country_functions submodules a stage uses, so changes elsewhere in the package do not make it stale
+    return [f'country_functions/{module}.py' for module in ('__init__', 'run_report') + modules]
+
+def encode_rnn_tokens():
+    # integer-encoded model inputs shared by the topic model and both rnn notebooks
+    tokens = cf.csv_from_s3('TOKENS-RNN.csv', s3, bucket, aws_folder, backend=store)
+    tokens.token = tokens.token.astype(str)
+    cf.encode_corpus(tokens, OHCO, os.path.join(run_folder, 'encoded-rnn'), backend=store, aws_folder='data/encoded-rnn')
+
+# country stages only: the scripts switch to pop through their '# change if pop' lines, not a parameter
+stages = [
+    cf.PipelineStage('charts', [sys.executable, '1-pull-charts.py'],
+                     outputs=['data/charts/'],
+                     code=['1-pull-charts.py'] + cf_code('scraping', 'storage'),
+                     params={'latest_chart_week' : latest_chart_week}),
+
+    cf.PipelineStage('lib', [sys.executable, '2-lib-features.py'],
+                     inputs=['data/charts/', 'data/gendered_country_band.csv', 'data/CHARTS.csv', 'data/ARTIST-ALIASES.csv', 'data/song-stats/'],
+                     outputs=['data/CHARTS.csv', 'data/ARTIST-ALIASES.csv', 'data/song-stats/', 'data/top_artists_decade.csv',
+                              'data/LIB.csv', 'data/TOP_SONGS_ORDER.csv'],
+                     code=['2-lib-features.py'] + cf_code('scraping', 'storage')),
+
+    cf.PipelineStage('lyrics', [sys.executable, '3-pull-lyrics.py'],
+                     inputs=['data/LIB.csv', 'data/lyrics-shards/'],
+                     outputs=['data/lyrics-shards/', 'data/LYRICS.csv'],
+                     code=['3-pull-lyrics.py'] + cf_code('scraping', 'storage')),
+
+    cf.PipelineStage('corpus', [sys.executable, '4-create-prune-content-tables.py'],
+                     inputs=['data/LYRICS.csv', 'data/LIB.csv'],
+                     outputs=['data/CORPUS.csv', 'data/CORPUS-REDUCED.csv', 'data/SECTION-REDUCED/', 'data/LINE-REDUCED/',
+                              'data/TOKEN-REDCUED/'],
+                     code=['4-create-prune-content-tables.py'] + cf_code('corpus', 'storage')),
+
+    # TOKENS-RNN.csv (vocab-reduced tokens) is written outside these scripts, so it is a source like the gender table
+    cf.PipelineStage('encoded-rnn', encode_rnn_tokens,
+                     inputs=['data/TOKENS-RNN.csv'],
+                     outputs=['data/encoded-rnn/'],
+                     code=cf_code('rnn_prep', 'storage')),
+
+    cf.PipelineStage('topic-model', notebook('topic-models-rnn.ipynb'),
+                     inputs=['data/encoded-rnn/'],
+                     outputs=['data/dtm-rnn/', 'data/rnn-topic-probs.csv'],
+                     code=['topic-models-rnn.ipynb'] + cf_code('rnn_prep', 'storage')),
+
+    # the two models only share inputs, so they train side by side; their checkpoints are keyed on the stage fingerprint,
+    # so new inputs start training over instead of resuming the previous run
+    cf.PipelineStage('rnn-simple', notebook('simpe-implementation.ipynb'),
+                     inputs=['data/encoded-rnn/', 'data/rnn-topic-probs.csv'],
+                     outputs=['data/rnn-simple/'],
+                     code=['simpe-implementation.ipynb'] + cf_code('rnn', 'rnn_prep', 'storage')),
+
+    cf.PipelineStage('rnn-advanced', notebook('advanced-model.ipynb'),
+                     inputs=['data/encoded-rnn/', 'data/rnn-topic-probs.csv'],
+                     outputs=['data/rnn-stateful/'],
+                     code=['advanced-model.ipynb'] + cf_code('rnn', 'rnn_prep', 'storage')),
+]
+
+##########
+# STEP 2 - RUN STALE STAGES
+##########
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    force = args[args.index('--force') + 1:] if '--force' in args else []
+    targets = [arg for arg in args if not arg.startswith('--') and arg not in force] + force or None
+
+    runner = cf.PipelineRunner(stages, store, max_workers=2, log_folder=run_folder) # change max_workers to run more stages at once
+    results = runner.run(targets, force=force, dry_run=dry_run, report=lambda name, status : print(f'{name}: {status}', flush=True))
+    print(results.to_string())
+    sys.exit(int((results.status == 'failed').any()))